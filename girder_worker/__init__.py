@@ -1,13 +1,17 @@
 import girder_worker.events
 import girder_worker.format
 import girder_worker.io
+import itertools
 import json
 import os
+import sys
 
 from girder_worker.format import (
-    converter_path, get_validator_analysis, Validator)
+    converter_path, get_validator_analysis, get_validator_function, Validator)
 from ConfigParser import SafeConfigParser
-from executors.python import run as python_run
+from multiprocessing.pool import ThreadPool
+from executors.python import (
+    code_cache, run as python_run, run_converter as python_run_converter)
 from executors.workflow import run as workflow_run
 from networkx import NetworkXNoPath
 from . import utils
@@ -19,6 +23,8 @@ _cfgs = ('worker.dist.cfg', 'worker.local.cfg')
 config = SafeConfigParser(os.environ)
 config.read([os.path.join(PACKAGE_DIR, f) for f in _cfgs])
 
+code_cache.resize(config.getint('girder_worker', 'code_cache_size'))
+
 # Maps task modes to their implementation
 _task_map = {}
 
@@ -117,7 +123,21 @@ def isvalid(type, binding, fetch=True, **kwargs):
     :returns: ``True`` if the binding matches the type and format,
         ``False`` otherwise.
     """
-    analysis = get_validator_analysis(Validator(type, binding['format']))
+    validator = Validator(type, binding['format'])
+    analysis = get_validator_analysis(validator)
+    validate = get_validator_function(validator)
+
+    # Call python validators directly rather than running them as a task,
+    # unless the data must first be fetched from elsewhere, or there is no temp
+    # dir for a validator that needs one.
+    remote = fetch and ('data' not in binding or 'url' in binding)
+    tempdir = kwargs.get('_tempdir') or not _uses_tmpdir(analysis)
+    if (validate is not None and not remote and tempdir and
+            not kwargs.get('write_script')):
+        if _uses_tmpdir(analysis):
+            utils.ensure_tmpdir(kwargs['_tempdir'])
+        return validate(binding['data'], **kwargs)
+
     outputs = girder_worker.run(analysis, {'input': binding},
                                 auto_convert=False,
                                 validate=False, fetch=fetch, **kwargs)
@@ -149,9 +169,35 @@ def convert(type, input, output, fetch=True, status=None, **kwargs):
         to the specified URI and
         returns the output binding unchanged.
     """
+    data = _convert_data(type, input, output, fetch=fetch, status=status,
+                         **kwargs)
+
+    if status == utils.JobStatus.CONVERTING_OUTPUT:
+        job_mgr = kwargs.get('_job_manager')
+        _job_status(job_mgr, utils.JobStatus.PUSHING_OUTPUT)
+    girder_worker.io.push(data, output, **kwargs)
+    return output
+
+
+@utils.with_tmpdir
+def _convert_data(type, input, output, fetch=True, status=None, **kwargs):
+    """
+    Perform the conversion of :py:func:`convert` without pushing the result.
+
+    Converters whose input or output has a ``filepath`` target, e.g. those of
+    the Spark plugin, read or write files rather than data in memory. Files
+    are passed to and from them as ``local`` bindings, which are fetched with
+    the target of the next converter. If the ``task_input`` or ``task_output``
+    being converted has a ``filepath`` target, the data to convert is the path
+    of a file, and a file written by the last converter is returned by path
+    rather than read into memory.
+
+    :returns: The converted data.
+    """
     if fetch:
         input['data'] = girder_worker.io.fetch(input, **kwargs)
 
+    port = kwargs.get('task_input') or kwargs.get('task_output') or {}
     if input['format'] == output['format']:
         data = input['data']
     else:
@@ -163,19 +209,123 @@ def convert(type, input, output, fetch=True, status=None, **kwargs):
             raise Exception('No conversion path from %s/%s to %s/%s' %
                             (type, input['format'], type, output['format']))
 
-        # Run data_descriptor through each conversion in the path
-        for conversion in conversion_path:
-            result = girder_worker.run(conversion, {'input': data_descriptor},
-                                       auto_convert=False, status=status,
-                                       **kwargs)
-            data_descriptor = result['output']
-        data = data_descriptor['data']
+        if _can_chain(conversion_path, **kwargs):
+            data = _run_chain(type, conversion_path, input, output,
+                              status=status, **kwargs)
+        else:
+            if port.get('target') == 'filepath':
+                data_descriptor = _file_binding(input['format'], input['data'])
+
+            # Run data_descriptor through each conversion in the path
+            for conversion in conversion_path:
+                result = girder_worker.run(
+                    conversion, {'input': data_descriptor},
+                    auto_convert=False, status=status, **kwargs)
+                data_descriptor = result['output']
+                if conversion['outputs'][0].get('target') == 'filepath':
+                    data_descriptor = _file_binding(
+                        data_descriptor['format'], data_descriptor['data'])
+
+            if data_descriptor.get('mode') != 'local':
+                data = data_descriptor['data']
+            elif port.get('target') == 'filepath':
+                data = data_descriptor['path']
+            else:
+                data = girder_worker.io.fetch(
+                    data_descriptor, **dict(kwargs, task_input={}))
 
-    if status == utils.JobStatus.CONVERTING_OUTPUT:
-        job_mgr = kwargs.get('_job_manager')
-        _job_status(job_mgr, utils.JobStatus.PUSHING_OUTPUT)
-    girder_worker.io.push(data, output, **kwargs)
-    return output
+    return data
+
+
+def _file_binding(format, path):
+    return {'format': format, 'mode': 'local', 'path': path}
+
+
+def _can_chain(conversion_path, **kwargs):
+    """
+    Determine whether the converters along a conversion path can be run as a
+    single compiled chain. This is the case when every converter is a python
+    task operating on in-memory data, and no script debugging was requested.
+    """
+    if kwargs.get('write_script'):
+        return False
+
+    for conversion in conversion_path:
+        if conversion.get('mode', 'python') != 'python':
+            return False
+        if conversion.get('write_script'):
+            return False
+        for port in conversion['inputs'] + conversion['outputs']:
+            if port.get('target', 'memory') != 'memory':
+                return False
+
+    return True
+
+
+@utils.with_tmpdir
+def _run_chain(data_type, conversion_path, input, output, status=None,
+               **kwargs):
+    """
+    Run a chain of python converters in one temp directory instead of
+    performing a full :py:func:`run` for each converter. As for :py:func:`run`,
+    the ``run.before``, ``run.after`` and ``run.finally`` events are triggered
+    for each converter, and its input and output are validated.
+    """
+    kwargs = dict(kwargs, fetch=False)
+    if any(_uses_tmpdir(c) for c in conversion_path):
+        utils.ensure_tmpdir(kwargs['_tempdir'])
+
+    if not girder_worker.isvalid(data_type, input, **kwargs):
+        raise Exception(
+            'Input (Python type %s) is not in the expected type (%s) and '
+            'format (%s).' % (type(input['data']), data_type, input['format']))
+
+    _job_status(kwargs.get('_job_manager'), status)
+    binding = {'format': input['format'], 'data': input['data']}
+    for conversion in conversion_path:
+        task_input, = conversion['inputs']
+        task_output, = conversion['outputs']
+        info = {
+            'task': conversion,
+            'task_inputs': {'input': task_input},
+            'task_outputs': {'output': task_output},
+            'mode': 'python',
+            'inputs': {'input': binding},
+            'outputs': {'output': {'format': task_output['format']}},
+            'auto_convert': False,
+            'validate': True,
+            'kwargs': kwargs
+        }
+        girder_worker.events.trigger('run.before', info)
+        try:
+            data = python_run_converter(conversion, binding['data'], **kwargs)
+
+            binding = {'format': task_output['format'], 'data': data}
+            if not girder_worker.isvalid(task_output['type'], binding,
+                                         **kwargs):
+                raise Exception(
+                    'Output (Python type %s) is not in the expected type (%s) '
+                    'and format (%s).' % (
+                        type(data), task_output['type'],
+                        task_output['format']))
+
+            info['outputs']['output']['data'] = data
+            girder_worker.events.trigger('run.after', info)
+        finally:
+            girder_worker.events.trigger('run.finally', info)
+
+    return binding['data']
+
+
+def _uses_tmpdir(task):
+    """
+    Determine whether the lazily allocated temp dir of a task must be created
+    before the task is executed. This is the case unless the task sets
+    ``tempdir`` to ``False``, which is the default for python converters and
+    validators, see :py:func:`girder_worker.format.import_converters`.
+    Workflows leave it to their steps.
+    """
+    return task.get('tempdir', task.get('mode', 'python') != 'workflow')
 
 
 def _job_status(mgr, status):
@@ -183,6 +333,150 @@ def _job_status(mgr, status):
         mgr.updateStatus(status)
 
 
+def _imap_concurrent(fn, items, concurrency):
+    """
+    Call a function on each of a list of items using a pool of up to
+    ``concurrency`` threads. If only one thread would be used, the calls are
+    made serially in the calling thread instead.
+
+    :returns: An iterator of ``(item, result, exc_info)`` tuples in the order
+        in which the calls complete. ``exc_info`` is ``None`` unless the call
+        raised an exception.
+    """
+    def call(item):
+        try:
+            return item, fn(item), None
+        except Exception:
+            return item, None, sys.exc_info()
+
+    concurrency = min(concurrency, len(items))
+    if concurrency <= 1:
+        for item in items:
+            yield call(item)
+        return
+
+    pool = ThreadPool(concurrency)
+    try:
+        for result in pool.imap_unordered(call, items):
+            yield result
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _raise_first(names, errors):
+    """
+    Raise the error of the first of the given names that failed, prefixed with
+    the name, so that the reported error does not depend on the order in which
+    concurrent operations completed.
+    """
+    for name in names:
+        if name in errors:
+            e = errors[name]
+            raise Exception('%s: %s' % (name, str(e[1]))), None, e[2]
+
+
+def _is_inline(binding):
+    return 'url' not in binding and binding.get('mode', 'auto') in (
+        'auto', 'inline')
+
+
+def _fetch_inputs(inputs, task_inputs, status=None, **kwargs):
+    """
+    Fetch the data of all inputs that are not streamed, using a pool of up to
+    ``fetch_concurrency`` threads. Once all fetches have finished, an error is
+    raised for the first input, in iteration order, that could not be fetched.
+    Progress is reported to the job manager as each fetch completes.
+
+    Fetch handlers are passed an empty ``_fetch_info`` dict in which they may
+    record information about the fetched data, e.g. its ``etag``, without
+    modifying the input binding.
+
+    :returns: A dict mapping the name of each fetched input to its
+        ``_fetch_info``.
+    """
+    job_mgr = kwargs.get('_job_manager')
+    names = [name for name in inputs
+             if not task_inputs[name].get('stream')]
+
+    for name in names:
+        d = inputs[name]
+        if ('data' not in d or
+                task_inputs[name].get('target', 'memory') != 'memory'):
+            utils.ensure_tmpdir(kwargs['_tempdir'])
+    remote = [name for name in names if 'data' not in inputs[name]]
+    if status == utils.JobStatus.RUNNING and remote:
+        _job_status(job_mgr, utils.JobStatus.FETCHING_INPUT)
+
+    fetch_info = {name: {} for name in names}
+
+    def fetch(name):
+        return girder_worker.io.fetch(inputs[name], **dict(
+            kwargs, task_input=task_inputs[name],
+            _fetch_info=fetch_info[name]))
+
+    # Only remote inputs are worth fetching on other threads
+    concurrency = config.getint('girder_worker', 'fetch_concurrency')
+    local = [name for name in names if name not in remote]
+    results = itertools.chain(_imap_concurrent(fetch, local, 1),
+                              _imap_concurrent(fetch, remote, concurrency))
+    errors = {}
+    done = 0
+    for name, data, error in results:
+        if error is not None:
+            errors[name] = error
+            continue
+        inputs[name]['data'] = data
+
+        if name in remote and job_mgr:
+            done += 1
+            job_mgr.updateProgress(
+                total=len(remote), current=done,
+                message='Fetched input %s' % name)
+
+    _raise_first(names, errors)
+    return fetch_info
+
+
+def _push_outputs(pushes, outputs, task_outputs, **kwargs):
+    """
+    Push the data of a list of outputs, given as ``(name, data)`` pairs, using
+    a pool of up to ``push_concurrency`` threads. Once all pushes have
+    finished, an error is raised for the first output in the list that could
+    not be pushed. Progress is reported to the job manager from the calling
+    thread as each push completes.
+    """
+    job_mgr = kwargs.get('_job_manager')
+    data = dict(pushes)
+
+    def push(name):
+        girder_worker.io.push(
+            data[name], outputs[name],
+            **dict({'task_output': task_outputs[name]}, **kwargs))
+
+    # Only remote outputs are worth pushing on other threads
+    names = [name for name, _ in pushes]
+    concurrency = config.getint('girder_worker', 'push_concurrency')
+    local = [name for name in names if _is_inline(outputs[name])]
+    remote = [name for name in names if name not in local]
+    results = itertools.chain(_imap_concurrent(push, local, 1),
+                              _imap_concurrent(push, remote, concurrency))
+    errors = {}
+    done = 0
+    for name, _, error in results:
+        if error is not None:
+            errors[name] = error
+            continue
+
+        if name in remote and job_mgr:
+            done += 1
+            job_mgr.updateProgress(
+                total=len(remote), current=done,
+                message='Pushed output %s' % name)
+
+    _raise_first(names, errors)
+
+
 @utils.with_tmpdir  # noqa
 def run(task, inputs=None, outputs=None, auto_convert=True, validate=True,
         fetch=True, status=None, **kwargs):
@@ -264,18 +558,17 @@ def run(task, inputs=None, outputs=None, auto_convert=True, validate=True,
                     raise Exception(
                         'Required input \'%s\' not provided.' % name)
 
+        # Fetch the inputs
+        fetch_info = {}
+        if fetch:
+            fetch_info = _fetch_inputs(
+                inputs, task_inputs, status=status, **kwargs)
+
         for name, d in inputs.iteritems():
             task_input = task_inputs[name]
             if task_input.get('stream'):
                 continue  # this input will be fetched as a stream
 
-            # Fetch the input
-            if fetch:
-                if status == utils.JobStatus.RUNNING and 'data' not in d:
-                    _job_status(job_mgr, utils.JobStatus.FETCHING_INPUT)
-                d['data'] = girder_worker.io.fetch(
-                    d, **dict({'task_input': task_input}, **kwargs))
-
             # Validate the input
             if validate and not girder_worker.isvalid(
                     task_input['type'], d,
@@ -321,10 +614,14 @@ def run(task, inputs=None, outputs=None, auto_convert=True, validate=True,
         _job_status(job_mgr, status)
 
         # Actually run the task for the given mode
+        if _uses_tmpdir(task):
+            utils.ensure_tmpdir(kwargs['_tempdir'])
         _task_map[mode](task=task, inputs=inputs, outputs=outputs,
                         task_inputs=task_inputs, task_outputs=task_outputs,
-                        auto_convert=auto_convert, validate=validate, **kwargs)
+                        auto_convert=auto_convert, validate=validate,
+                        **dict(kwargs, _fetch_info=fetch_info))
 
+        pushes = []
         for name, task_output in task_outputs.iteritems():
             if task_output.get('stream'):
                 continue  # this output has already been sent as a stream
@@ -348,21 +645,24 @@ def run(task, inputs=None, outputs=None, auto_convert=True, validate=True,
             # the paths through this code is difficult, since this logic is
             # entered by 'run', 'isvalid', and 'convert'.
             if auto_convert:
-                outputs[name] = girder_worker.convert(
+                data = _convert_data(
                     task_output['type'], script_output, d,
                     status=utils.JobStatus.CONVERTING_OUTPUT,
                     **dict({'task_output': task_output}, **kwargs))
             elif d['format'] == task_output['format']:
                 data = d['script_data']
-
-                if status == utils.JobStatus.RUNNING:
-                    _job_status(job_mgr, utils.JobStatus.PUSHING_OUTPUT)
-                girder_worker.io.push(
-                    data, d, **dict({'task_output': task_output}, **kwargs))
             else:
                 raise Exception('Expected exact format match but %s != %s.' % (
                     d['format'], task_output['format']))
 
+            pushes.append((name, data))
+
+        # Push all of the outputs once they have been converted
+        if pushes and (auto_convert or status == utils.JobStatus.RUNNING):
+            _job_status(job_mgr, utils.JobStatus.PUSHING_OUTPUT)
+        _push_outputs(pushes, outputs, task_outputs, **kwargs)
+
+        for name, _ in pushes:
             if 'script_data' in outputs[name]:
                 del outputs[name]['script_data']
 
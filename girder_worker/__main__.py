@@ -1,16 +1,49 @@
 import girder_worker
-from girder_worker.format import conv_graph
+import importlib
+from girder_worker.executors.python import code_cache
+from girder_worker.format import conv_graph, direct_converters
 
 from .utils import JobManager, JobStatus
 from celery import Celery
+from celery.utils.log import get_logger
 
 app = None
+logger = get_logger(__name__)
 
 
 class _CeleryConfig:
     CELERY_ACCEPT_CONTENT = ['json', 'pickle', 'yaml']
 
 
+def _preload_modules():
+    """
+    Import the modules listed in the ``preload_modules`` config option. This
+    happens before celery forks its pool of worker processes, so that each of
+    them starts with these modules already imported, rather than importing
+    them when they are first used by a task, e.g. inside a converter.
+    """
+    modules = girder_worker.config.get('girder_worker', 'preload_modules')
+    for name in modules.split(','):
+        name = name.strip()
+        if not name:
+            continue
+        try:
+            importlib.import_module(name)
+        except ImportError as e:
+            logger.warning('Could not preload module %s: %s', name, e)
+
+
+def _warm_code_cache():
+    """
+    Compile the scripts of all python converters before forking the worker
+    processes, so that they are already in each process's code cache.
+    """
+    analyses = [analysis for _, _, analysis in conv_graph.edges(data=True)]
+    for analysis in analyses + direct_converters.values():
+        if analysis.get('mode', 'python') == 'python' and 'script' in analysis:
+            code_cache.compile(analysis['script'])
+
+
 def main():
     global app
     app = Celery(
@@ -19,6 +52,12 @@ def main():
         broker=girder_worker.config.get('celery', 'broker'))
     app.config_from_object(_CeleryConfig)
 
+    # Worker processes are reused across tasks, and replaced after running
+    # this many tasks, if set, to bound the growth of their memory use.
+    max_tasks = girder_worker.config.getint(
+        'girder_worker', 'max_tasks_per_child')
+    app.conf.update(CELERYD_MAX_TASKS_PER_CHILD=max_tasks or None)
+
     @app.task
     def run(*pargs, **kwargs):
         jobInfo = kwargs.pop('jobInfo', {})
@@ -51,6 +90,8 @@ def main():
 
         return nodes
 
+    _preload_modules()
+    _warm_code_cache()
     app.worker_main()
 
 
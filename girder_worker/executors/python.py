@@ -1,38 +1,170 @@
+import collections
+import hashlib
 import imp
 import json
+import six
 import sys
 import tempfile
+import threading
 
+from girder_worker.io import make_stream_fetch_adapter, make_stream_push_adapter
 
-def run(task, inputs, outputs, task_inputs, task_outputs, **kwargs):
+
+class CodeCache(object):
+    """
+    A size-bounded LRU cache of compiled task scripts, keyed by a hash of the
+    script source. This avoids recompiling the same script, e.g. a converter or
+    validator, each time it is executed.
+    """
+    def __init__(self, maxsize=256):
+        """
+        :param maxsize: The maximum number of code objects to keep.
+        :type maxsize: int
+        """
+        self.maxsize = maxsize
+        self._cache = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    def compile(self, script):
+        """
+        Return the code object for the given script source, compiling it if it
+        is not already in the cache.
+
+        :param script: The python source of the script.
+        :type script: str
+        """
+        source = script
+        if isinstance(source, six.text_type):
+            source = source.encode('utf8')
+        key = hashlib.sha1(source).hexdigest()
+
+        with self._lock:
+            code = self._cache.pop(key, None)
+            if code is not None:
+                self._stats['hits'] += 1
+                self._cache[key] = code
+                return code
+            self._stats['misses'] += 1
+
+        code = compile(script, '<string>', 'exec')
+
+        with self._lock:
+            self._cache[key] = code
+            self._evict()
+        return code
+
+    def resize(self, maxsize):
+        """
+        Change the maximum size of the cache, evicting the least recently used
+        entries if necessary.
+
+        :param maxsize: The maximum number of code objects to keep.
+        :type maxsize: int
+        """
+        with self._lock:
+            self.maxsize = maxsize
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def stats(self):
+        """
+        :returns: A dict containing the number of ``hits``, ``misses`` and
+            ``evictions`` of the cache, as well as its current ``size`` and
+            ``maxsize``.
+        """
+        with self._lock:
+            return dict(self._stats, size=len(self._cache),
+                        maxsize=self.maxsize)
+
+    def _evict(self):
+        while len(self._cache) > max(self.maxsize, 0):
+            self._cache.popitem(last=False)
+            self._stats['evictions'] += 1
+
+
+# The cache shared by all executors that run python scripts in process
+code_cache = CodeCache()
+
+
+def _exec(task, namespace):
+    try:
+        exec code_cache.compile(task['script']) in namespace
+    except Exception, e:
+        trace = sys.exc_info()[2]
+        lines = task['script'].split('\n')
+        lines = [(str(i+1) + ': ' + lines[i]) for i in xrange(len(lines))]
+        error = (
+            str(e) + '\nScript:\n' + '\n'.join(lines) +
+            '\nTask:\n' + json.dumps(task, indent=4)
+        )
+        raise Exception(error), None, trace
+
+
+def _new_module(**kwargs):
     custom = imp.new_module('__girder_worker__')
 
     custom.__dict__['_job_manager'] = kwargs.get('_job_manager')
     custom.__dict__['_tempdir'] = kwargs.get('_tempdir')
 
+    return custom
+
+
+def run(task, inputs, outputs, task_inputs, task_outputs, **kwargs):
+    custom = _new_module(**kwargs)
+
+    # Streaming inputs and outputs are bound to stream adapters, which the
+    # script reads from and writes to.
+    streams = []
     for name in inputs:
-        custom.__dict__[name] = inputs[name]['script_data']
-
-    if task.get('write_script', kwargs.get('write_script', False)):
-        debug_path = tempfile.mktemp()
-        with open(debug_path, 'wb') as fh:
-            fh.write(task['script'])
-
-        with open(debug_path, 'r') as fh:
-            exec fh in custom.__dict__
-
-    else:
-        try:
-            exec task['script'] in custom.__dict__
-        except Exception, e:
-            trace = sys.exc_info()[2]
-            lines = task['script'].split('\n')
-            lines = [(str(i+1) + ': ' + lines[i]) for i in xrange(len(lines))]
-            error = (
-                str(e) + '\nScript:\n' + '\n'.join(lines) +
-                '\nTask:\n' + json.dumps(task, indent=4)
-            )
-            raise Exception(error), None, trace
+        if task_inputs[name].get('stream'):
+            custom.__dict__[name] = make_stream_fetch_adapter(inputs[name])
+        else:
+            custom.__dict__[name] = inputs[name]['script_data']
 
     for name, task_output in task_outputs.iteritems():
-        outputs[name]['script_data'] = custom.__dict__[name]
+        if task_output.get('stream'):
+            adapter = make_stream_push_adapter(outputs[name])
+            custom.__dict__[name] = adapter
+            streams.append(adapter)
+
+    try:
+        if task.get('write_script', kwargs.get('write_script', False)):
+            debug_path = tempfile.mktemp()
+            with open(debug_path, 'wb') as fh:
+                fh.write(task['script'])
+
+            with open(debug_path, 'r') as fh:
+                exec fh in custom.__dict__
+
+        else:
+            _exec(task, custom.__dict__)
+    finally:
+        for adapter in streams:
+            adapter.close()
+
+    for name, task_output in task_outputs.iteritems():
+        if not task_output.get('stream'):
+            outputs[name]['script_data'] = custom.__dict__[name]
+
+
+def run_converter(task, data, **kwargs):
+    """
+    Run a python task that has a single input named ``input`` and a single
+    output named ``output``, such as a converter or a validator, on in-memory
+    data. The task
+    is executed in a new module namespace, so that no variables of previously
+    run tasks are visible to it.
+
+    :param task: The task to run.
+    :type task: dict
+    :param data: The data to bind to the input of the task.
+    :returns: The output of the task.
+    """
+    custom = _new_module(**kwargs)
+    custom.__dict__['input'] = data
+    _exec(task, custom.__dict__)
+    return custom.__dict__['output']
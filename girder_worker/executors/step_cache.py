@@ -0,0 +1,220 @@
+import cPickle as pickle
+import errno
+import girder_worker
+import glob
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+from girder_worker.utils import _makedirs
+
+
+class StepCache(object):
+    """
+    A size-bounded cache of the outputs of workflow steps on local disk, keyed
+    by a hash of each step's task and inputs (see :py:func:`step_key`). This
+    allows re-running a workflow to skip the steps whose inputs did not change.
+    Once the total size of the cache exceeds its maximum size, the least
+    recently used entries are evicted.
+
+    The entries are unpickled when they are read, so the cache directory must
+    only be writable by trusted users. It is created readable and writable
+    only by its owner.
+    """
+    def __init__(self, path, maxsize):
+        """
+        :param path: The directory in which to store the cached outputs.
+        :type path: str
+        :param maxsize: The maximum total size of the cache in bytes.
+        :type maxsize: int
+        """
+        self.path = path
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+        _makedirs(path, 0o700)
+
+    def _file(self, key):
+        return os.path.join(self.path, key + '.pkl')
+
+    def get(self, key):
+        """
+        Return the cached outputs for the given key, or ``None`` if there are
+        none.
+
+        :param key: The key of the step, as returned by :py:func:`step_key`.
+        :type key: str
+        """
+        path = self._file(key)
+        try:
+            with open(path, 'rb') as f:
+                outputs = pickle.load(f)
+            os.utime(path, None)  # Mark the entry as recently used
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            outputs = None
+
+        with self._lock:
+            self._stats['hits' if outputs is not None else 'misses'] += 1
+        return outputs
+
+    def put(self, key, outputs):
+        """
+        Store the outputs of a step in the cache. Outputs that cannot be
+        pickled are not cached.
+
+        :param key: The key of the step, as returned by :py:func:`step_key`.
+        :type key: str
+        :param outputs: The outputs returned by :py:func:`girder_worker.run`
+            for the step.
+        :type outputs: dict
+        :returns: Whether the outputs were cached.
+        """
+        try:
+            data = pickle.dumps(outputs, pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            return False
+
+        if len(data) > self.maxsize:
+            return False
+
+        # Write to a temp file and rename it so that other processes sharing
+        # the cache never read a partially written entry.
+        fd, tmp = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.rename(tmp, self._file(key))
+
+        with self._lock:
+            self._evict()
+        return True
+
+    def clear(self):
+        with self._lock:
+            for path in glob.glob(os.path.join(self.path, '*.pkl')):
+                _remove(path)
+
+    def stats(self):
+        """
+        :returns: A dict containing the number of ``hits``, ``misses`` and
+            ``evictions`` of the cache, as well as its current ``size`` and
+            ``maxsize`` in bytes.
+        """
+        with self._lock:
+            size = sum(size for _, size, _ in self._entries())
+            return dict(self._stats, size=size, maxsize=self.maxsize)
+
+    def _entries(self):
+        entries = []
+        for path in glob.glob(os.path.join(self.path, '*.pkl')):
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue  # Evicted by another process
+            entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def _evict(self):
+        entries = sorted(self._entries())
+        size = sum(size for _, size, _ in entries)
+        for _, entry_size, path in entries:
+            if size <= self.maxsize:
+                break
+            _remove(path)
+            size -= entry_size
+            self._stats['evictions'] += 1
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+
+
+def _hash(*parts):
+    return hashlib.sha1(json.dumps(
+        parts, sort_keys=True, default=repr)).hexdigest()
+
+
+def binding_key(binding, format, data, etag=None):
+    """
+    Compute the key of an input of a workflow. Inputs that were fetched from a
+    URL whose response had an ``ETag`` are identified by the URL and ETag, so
+    that their data need not be hashed. Otherwise the data is hashed.
+
+    :param binding: The input binding of the workflow.
+    :type binding: dict
+    :param format: The format the input was converted to.
+    :param data: The converted data.
+    :param etag: The ETag of the response the input was fetched from, if any.
+    :type etag: str
+    :returns: The key, or ``None`` if the data cannot be pickled.
+    """
+    if binding.get('url') and etag:
+        return _hash('url', binding['url'], binding.get('params'),
+                     etag, binding.get('format'), format)
+    return data_key(format, data)
+
+
+def data_key(format, data):
+    """
+    Compute the key of a piece of data by hashing its pickled value.
+
+    :returns: The key, or ``None`` if the data cannot be pickled.
+    """
+    try:
+        data = pickle.dumps(data, pickle.HIGHEST_PROTOCOL)
+    except Exception:
+        return None
+    return _hash('data', format, hashlib.sha1(data).hexdigest())
+
+
+def step_key(task, input_keys):
+    """
+    Compute the key of a workflow step from its task and the keys of its
+    input bindings.
+
+    :param task: The task of the step.
+    :type task: dict
+    :param input_keys: A dict mapping the name of each bound input to its key.
+    :type input_keys: dict
+    :returns: The key, or ``None`` if the key of some input is unknown.
+    """
+    if None in input_keys.values():
+        return None
+    return _hash('step', task, input_keys)
+
+
+def output_key(step_key, name):
+    """
+    Compute the key of an output of a cacheable step from the key of the step.
+    This avoids hashing the data of outputs that are passed between steps.
+    """
+    return _hash('output', step_key, name)
+
+
+_step_cache = None
+
+
+def get_step_cache():
+    """
+    Return the step cache configured by the ``step_cache_dir`` and
+    ``step_cache_size`` options of the ``girder_worker`` config section, or
+    ``None`` if the step cache is disabled, which is the default.
+    """
+    global _step_cache
+
+    path = girder_worker.config.get('girder_worker', 'step_cache_dir')
+    if not path:
+        return None
+
+    path = os.path.abspath(path)
+    maxsize = girder_worker.config.getint('girder_worker', 'step_cache_size')
+    if _step_cache is None or _step_cache.path != path:
+        _step_cache = StepCache(path, maxsize)
+    _step_cache.maxsize = maxsize
+    return _step_cache
@@ -1,6 +1,187 @@
 import girder_worker
+import os
+import Queue
+import sys
+import threading
+import uuid
 
-from girder_worker.utils import toposort
+from girder_worker.executors.step_cache import (
+    binding_key, data_key, get_step_cache, output_key, step_key)
+from girder_worker.utils import _set_cloexec, toposort
+from multiprocessing.pool import ThreadPool
+
+
+def _call_step(run_step, step, done):
+    try:
+        done.put((step, run_step(step), None))
+    except Exception:
+        done.put((step, None, sys.exc_info()))
+    except BaseException:
+        # Errors that are not exceptions, e.g. SystemExit, are passed back so
+        # that the thread waiting for the step wakes, but still propagate.
+        done.put((step, None, sys.exc_info()))
+        raise
+
+
+def _run_dag(dependencies, run_step, finish_step, concurrency):
+    """
+    Run the steps of a workflow in dependency order. Each step is run as soon
+    as all of the steps it depends on have finished, using a pool of up to
+    ``concurrency`` threads. Steps are finished, i.e. their outputs are bound
+    to their downstream steps, on the calling thread.
+
+    If a step fails, no further steps are started, and the error of the first
+    failed step is raised once the steps that are already running finish.
+
+    :param dependencies: A dict mapping each step name to the set of names of
+        the steps it depends on.
+    :param run_step: A function called with a step name to run the step.
+    :param finish_step: A function called on the calling thread with a step
+        name and the return value of ``run_step``.
+    :param concurrency: The maximum number of steps to run at once.
+    :type concurrency: int
+    """
+    # Detect cycles before running anything
+    list(toposort({k: set(v) for k, v in dependencies.iteritems()}))
+
+    pending = {step: deps - {step} for step, deps in dependencies.iteritems()}
+    done = Queue.Queue()
+    pool = ThreadPool(concurrency) if concurrency > 1 else None
+    running = 0
+    error = None
+    try:
+        while running or (pending and error is None):
+            ready = sorted(s for s, deps in pending.iteritems() if not deps)
+            if error is None and ready:
+                # Without a pool, steps run one at a time on this thread
+                for step in (ready if pool else ready[:1]):
+                    del pending[step]
+                    running += 1
+                    if pool is None:
+                        _call_step(run_step, step, done)
+                    else:
+                        pool.apply_async(_call_step, (run_step, step, done))
+
+            step, out, exc_info = done.get()
+            running -= 1
+            if exc_info is not None:
+                error = error or exc_info
+            elif error is None:
+                finish_step(step, out)
+                for deps in pending.itervalues():
+                    deps.discard(step)
+    finally:
+        if pool is not None:
+            if error is None or isinstance(error[1], Exception):
+                pool.close()
+                pool.join()
+            else:
+                # The worker thread of the step died with the error, so its
+                # task would never be marked as done and join() would block
+                pool.terminate()
+
+    if error is not None:
+        raise error[0], error[1], error[2]
+
+
+def _stream_groups(steps, connections):
+    """
+    Group the steps of a workflow that are connected by streams, directly or
+    indirectly. The steps in a group must run concurrently, so each group is
+    scheduled as a unit.
+
+    :returns: A dict mapping each step name to its group, a sorted tuple of
+        step names.
+    """
+    groups = {name: {name} for name in steps}
+    for conn in connections:
+        if conn.get('stream'):
+            if 'input_step' not in conn or 'output_step' not in conn:
+                raise Exception(
+                    'Only connections between steps can be streamed.')
+            merged = groups[conn['output_step']] | groups[conn['input_step']]
+            for name in merged:
+                groups[name] = merged
+
+    return {name: tuple(sorted(group)) for name, group in groups.iteritems()}
+
+
+def _connect_streams(steps, connections, bindings, step_outputs, pipes):
+    """
+    Create a pipe for each streamed connection between two steps, and bind its
+    ends to the output of the upstream step and the input of the downstream
+    step. The ends of the pipes are also added to the lists in ``pipes``,
+    keyed by the step that uses them.
+    """
+    for conn in connections:
+        if not conn.get('stream'):
+            continue
+
+        step, name = conn['output_step'], conn['output']
+        if name in step_outputs[step]:
+            raise Exception('Streamed output %s of step %s cannot have more '
+                            'than one connection.' % (name, step))
+
+        port = [p for p in steps[step]['task']['outputs']
+                if p.get('id', p.get('name')) == name][0]
+        read, write = os.pipe()
+        # Subprocesses of the steps must not inherit the pipe, or the reading
+        # end would not see the end of the stream while they run.
+        _set_cloexec(read)
+        _set_cloexec(write)
+        read, write = os.fdopen(read, 'rb', 0), os.fdopen(write, 'wb', 0)
+        step_outputs[step][name] = {
+            'mode': 'pipe', 'format': port['format'], 'pipe': write}
+        bindings[conn['input_step']][conn['input']] = {
+            'mode': 'pipe', 'format': port['format'], 'pipe': read}
+        pipes[step].append(write)
+        pipes[conn['input_step']].append(read)
+
+
+def _run_stream_group(group, run_step, pipes):
+    """
+    Run the steps of a group connected by streams concurrently, each on its
+    own thread. When a step finishes, its ends of the pipes are closed so that
+    the steps it streams to or from do not block forever if it failed. The
+    error of the first step to fail is raised once all steps have finished.
+
+    :returns: A dict mapping each step name to the return value of
+        ``run_step``.
+    """
+    done = Queue.Queue()
+
+    def call(step):
+        try:
+            _call_step(run_step, step, done)
+        finally:
+            for pipe in pipes[step]:
+                pipe.close()
+
+    threads = [threading.Thread(target=call, args=(step,)) for step in group]
+    for thread in threads:
+        thread.start()
+
+    results = [done.get() for _ in group]
+    for thread in threads:
+        thread.join()
+
+    for _, _, exc_info in results:
+        if exc_info is not None:
+            raise exc_info[0], exc_info[1], exc_info[2]
+
+    return {step: out for step, out, _ in results}
+
+
+def _is_cacheable(step, group):
+    """
+    Determine whether the outputs of a workflow step may be cached. Steps can
+    opt out by setting ``cache`` to ``False``, e.g. if they are not
+    deterministic. Steps connected by streams, and steps with outputs written
+    to their temp dir, which does not outlive the workflow, are not cached.
+    """
+    return step.get('cache', True) and len(group) == 1 and not any(
+        port.get('target') == 'filepath'
+        for port in step['task'].get('outputs', ()))
 
 
 def run(task, inputs, outputs, task_inputs, task_outputs, validate,  # noqa
@@ -11,16 +192,33 @@ def run(task, inputs, outputs, task_inputs, task_outputs, validate,  # noqa
     # Make map of input bindings
     bindings = {step['name']: {} for step in task['steps']}
 
+    # Keys of the inputs and of the steps themselves in the step cache
+    cache = get_step_cache()
+    input_keys = {step['name']: {} for step in task['steps']}
+    step_keys = {}
+
+    # Connect streamed outputs to their downstream steps through pipes
+    step_outputs = {step['name']: {} for step in task['steps']}
+    pipes = {step['name']: [] for step in task['steps']}
+    groups = _stream_groups(steps, task['connections'])
+
     # Create dependency graph and downstream pointers
-    dependencies = {step['name']: set() for step in task['steps']}
+    dependencies = {group: set() for group in groups.itervalues()}
     downstream = {}
     for conn in task['connections']:
         # Add dependency graph link for internal links
-        if 'input_step' in conn and 'output_step' in conn:
-            dependencies[conn['input_step']].add(conn['output_step'])
+        if ('input_step' in conn and 'output_step' in conn and
+                not conn.get('stream')):
+            group = groups[conn['input_step']]
+            if group == groups[conn['output_step']]:
+                raise Exception(
+                    'Steps %s and %s run concurrently since they are '
+                    'connected by streams, so they cannot depend on each '
+                    'other.' % (conn['output_step'], conn['input_step']))
+            dependencies[group].add(groups[conn['output_step']])
 
         # Add downstream links for links with output
-        if 'output_step' in conn:
+        if 'output_step' in conn and not conn.get('stream'):
             ds = downstream.setdefault(conn['output_step'], {})
             ds_list = ds.setdefault(conn['output'], [])
             ds_list.append(conn)
@@ -32,32 +230,84 @@ def run(task, inputs, outputs, task_inputs, task_outputs, validate,  # noqa
                 'format': task_inputs[name]['format'],
                 'data': inputs[name]['script_data']
             }
+            if cache is not None:
+                input_keys[conn['input_step']][conn['input']] = binding_key(
+                    inputs[name], task_inputs[name]['format'],
+                    inputs[name]['script_data'],
+                    kwargs.get('_fetch_info', {}).get(name, {}).get('etag'))
+
+    def run_step(step):
+        # Visualizations cannot be executed
+        if steps[step].get('visualization'):
+            return None
+
+        # Skip steps whose task and inputs are unchanged since a previous run
+        key = None
+        if cache is not None and _is_cacheable(steps[step], groups[step]):
+            key = step_keys[step] = step_key(
+                steps[step]['task'], input_keys[step])
+        if key is not None:
+            out = cache.get(key)
+            if out is not None:
+                print '--- cached: %s ---' % steps[step]['name']
+                return out
+
+        # Steps may run concurrently, so each is given its own temp dir inside
+        # that of the workflow, to keep files of the same name apart. It is
+        # shared by the runs nested in the step, and removed along with the
+        # workflow's temp dir, so that filepath outputs outlive the step.
+        print '--- beginning: %s ---' % steps[step]['name']
+        out = girder_worker.run(steps[step]['task'], bindings[step],
+                                outputs=step_outputs[step],
+                                _tempdir=os.path.join(
+                                    kwargs['_tempdir'],
+                                    'tmp' + uuid.uuid4().hex))
+        print '--- finished: %s ---' % steps[step]['name']
+
+        if key is not None:
+            cache.put(key, out)
+        return out
+
+    def finish_step(step, out):
+        # Update bindings of downstream analyses
+        if out is not None and step in downstream:
+            for name, conn_list in downstream[step].iteritems():
+                for conn in conn_list:
+                    if 'input_step' in conn:
+                        # This is a connection to a downstream step
+                        b = bindings[conn['input_step']]
+                        b[conn['input']] = out[name]
+                        if cache is not None:
+                            key = step_keys.get(step)
+                            input_keys[conn['input_step']][conn['input']] = (
+                                output_key(key, name) if key else
+                                data_key(out[name]['format'],
+                                         out[name]['data']))
+                    else:
+                        # This is a connection to a final output
+                        o = outputs[conn['name']]
+                        o['script_data'] = out[name]['data']
+
+    def run_group(group):
+        if len(group) == 1:
+            return {group[0]: run_step(group[0])}
+        return _run_stream_group(group, run_step, pipes)
+
+    def finish_group(group, outs):
+        for step in group:
+            finish_step(step, outs[step])
 
-    # Traverse analyses in topological order
-    for step_set in toposort(dependencies):
-        for step in step_set:
-            # Visualizations cannot be executed
-            if ('visualization' in steps[step] and
-                    steps[step]['visualization']):
-                continue
-
-            # Run step
-            print '--- beginning: %s ---' % steps[step]['name']
-            out = girder_worker.run(steps[step]['task'], bindings[step])
-            print '--- finished: %s ---' % steps[step]['name']
-
-            # Update bindings of downstream analyses
-            if step in downstream:
-                for name, conn_list in downstream[step].iteritems():
-                    for conn in conn_list:
-                        if 'input_step' in conn:
-                            # This is a connection to a downstream step
-                            b = bindings[conn['input_step']]
-                            b[conn['input']] = out[name]
-                        else:
-                            # This is a connection to a final output
-                            o = outputs[conn['name']]
-                            o['script_data'] = out[name]['data']
+    # Traverse analyses in dependency order
+    concurrency = girder_worker.config.getint(
+        'girder_worker', 'workflow_concurrency')
+    _connect_streams(steps, task['connections'], bindings, step_outputs,
+                     pipes)
+    try:
+        _run_dag(dependencies, run_group, finish_group, concurrency)
+    finally:
+        for step_pipes in pipes.itervalues():
+            for pipe in step_pipes:
+                pipe.close()
 
     # Output visualization parameters
     outputs['_visualizations'] = []
@@ -1,18 +1,81 @@
 import csv
 import json
 import glob
+import itertools
 import os
 import math
+import re
+import six
 import girder_worker.io
 import networkx as nx
+from girder_worker.executors.python import code_cache, run_converter
 from collections import namedtuple
+from six.moves import cStringIO as StringIO
+from networkx import NetworkXNoPath
 from networkx.algorithms.shortest_paths.generic import all_shortest_paths
 from networkx.algorithms.shortest_paths.unweighted import (
     single_source_shortest_path
 )
 
 
-conv_graph = nx.DiGraph()
+class ConversionGraph(nx.DiGraph):
+    """
+    A directed graph of validators (nodes) and converters (edges). Any change
+    to the structure of the graph invalidates the conversion route table used
+    by :py:func:`converter_path`.
+    """
+    def add_node(self, *args, **kwargs):
+        nx.DiGraph.add_node(self, *args, **kwargs)
+        clear_route_table()
+
+    def add_nodes_from(self, *args, **kwargs):
+        nx.DiGraph.add_nodes_from(self, *args, **kwargs)
+        clear_route_table()
+
+    def remove_node(self, *args, **kwargs):
+        nx.DiGraph.remove_node(self, *args, **kwargs)
+        clear_route_table()
+
+    def remove_nodes_from(self, *args, **kwargs):
+        nx.DiGraph.remove_nodes_from(self, *args, **kwargs)
+        clear_route_table()
+
+    def add_edge(self, *args, **kwargs):
+        nx.DiGraph.add_edge(self, *args, **kwargs)
+        clear_route_table()
+
+    def add_edges_from(self, *args, **kwargs):
+        nx.DiGraph.add_edges_from(self, *args, **kwargs)
+        clear_route_table()
+
+    def remove_edge(self, *args, **kwargs):
+        nx.DiGraph.remove_edge(self, *args, **kwargs)
+        clear_route_table()
+
+    def remove_edges_from(self, *args, **kwargs):
+        nx.DiGraph.remove_edges_from(self, *args, **kwargs)
+        clear_route_table()
+
+    def clear(self):
+        nx.DiGraph.clear(self)
+        clear_route_table()
+
+
+# Maps (source, target) validator pairs to the tuple of converter analyses
+# along the chosen conversion path, or None if no path exists.
+_route_table = {}
+_route_stats = {'hits': 0, 'misses': 0}
+
+# Maps (source, target) validator pairs to the analyses of direct converters,
+# which are only used to convert from their source to their target, and never
+# as a step of a longer conversion path.
+direct_converters = {}
+
+# Maps validators to (analysis, function) pairs for validators that can be
+# called directly instead of being run as a task.
+_validator_functions = {}
+
+conv_graph = ConversionGraph()
 
 
 class Validator(namedtuple('Validator', ['type', 'format'])):
@@ -42,56 +105,412 @@ class Validator(namedtuple('Validator', ['type', 'format'])):
         return self in conv_graph.nodes()
 
 
+# Patterns for the values that int() and float() accept, excluding NaN and
+# Inf since these do not pass through JSON converters cleanly.
+_int_re = re.compile(r'^\s*[-+]?\d+\s*$')
+_float_re = re.compile(r'^\s*[-+]?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?\s*$')
+
+
+def _csv_lines(stream, sample):
+    """
+    Iterate over the lines of a CSV stream, starting with those already read
+    into ``sample``. Old-style lines ending with a bare carriage return are
+    split.
+    """
+    lines = itertools.chain(StringIO(sample), stream)
+    if '\r' not in sample.replace('\r\n', ''):
+        return lines
+    return (part for line in lines for part in line.splitlines(True))
+
+
 def get_csv_reader(input):
+    """
+    Create a ``csv.DictReader`` over CSV or TSV data. Only a sample of the data
+    is read to determine its dialect; the rest is read as rows are requested.
 
-    # csv package does not support unicode
-    input = str(input)
+    :param input: The CSV data, either as a string or a file-like object.
+    :returns: A ``csv.DictReader`` yielding each row as a dict.
+    """
+    if hasattr(input, 'read'):
+        stream = input
+    else:
+        # csv package does not support unicode
+        stream = StringIO(str(input))
+
+    # Take a data sample, in 5000 byte increments, until it contains at least
+    # one complete line
+    sample = ''
+    while True:
+        chunk = stream.read(5000)
+        sample += chunk
+        lines = sample.splitlines()
+        if not chunk or len(lines) > 1:
+            break
 
     # Special case: detect single-column files.
     # This check assumes that our only valid delimiters are commas and tabs.
-    firstLine = input.split('\n')[0]
-    if not ('\t' in firstLine or ',' in firstLine) \
-            or len(input.splitlines()) == 1:
+    firstLine = sample.split('\n')[0]
+    if not ('\t' in firstLine or ',' in firstLine) or len(lines) == 1:
         dialect = 'excel'
 
     else:
-        # Take a data sample to determine dialect, but
+        # Use the sample to determine dialect, but
         # don't include incomplete last line
-        sample = ''
-        sampleSize = 0
-        while len(sample) == 0:
-            sampleSize += 5000
-            sample = '\n'.join(input[:sampleSize].splitlines()[:-1])
-        dialect = csv.Sniffer().sniff(sample)
+        dialect = csv.Sniffer().sniff('\n'.join(lines[:-1]))
         dialect.skipinitialspace = True
-    return csv.DictReader(input.splitlines(), dialect=dialect)
+
+    # Complete the last line of the sample before handing it to the reader
+    sample += stream.readline()
+    return csv.DictReader(_csv_lines(stream, sample), dialect=dialect)
+
+
+def _to_number(value):
+    """
+    Convert a CSV value to an int or float if it represents one, otherwise
+    return it unchanged.
+    """
+    if not isinstance(value, str) or not _float_re.match(value):
+        return value
+    if _int_re.match(value):
+        return int(value)
+
+    number = float(value)
+    return value if math.isinf(number) else number
+
+
+def _is_int_column(values):
+    return all(isinstance(v, str) and _int_re.match(v) for v in values)
+
+
+def _column_to_numbers(values, is_int):
+    """
+    Convert a column of CSV values to numbers. Columns that were inferred to
+    hold integers are converted in bulk, falling back to converting each value
+    separately if some of them are not integers.
+    """
+    if is_int:
+        try:
+            return map(int, values)
+        except (TypeError, ValueError):
+            pass
+    return map(_to_number, values)
+
+
+def iter_csv_rows(reader, chunk_size=1000):
+    """
+    Yield the rows of a CSV reader with numeric values converted to numbers.
+    Rows are read and converted in chunks of ``chunk_size`` rows, one column at
+    a time, so memory use does not depend on the size of the data. The type of
+    each column is inferred once from the first chunk.
+
+    :param reader: A ``csv.DictReader``, as created by
+        :py:func:`get_csv_reader`.
+    :param chunk_size: The number of rows to convert at once.
+    :type chunk_size: int
+    """
+    int_columns = None
+
+    while True:
+        chunk = list(itertools.islice(reader, chunk_size))
+        if not chunk:
+            return
+
+        columns = set(reader.fieldnames)
+        if int_columns is None:
+            int_columns = {col for col in columns if _is_int_column(
+                [row[col] for row in chunk])}
+
+        for col in columns:
+            values = _column_to_numbers(
+                [row[col] for row in chunk], col in int_columns)
+            for row, value in itertools.izip(chunk, values):
+                row[col] = value
+
+        for row in chunk:
+            yield row
 
 
 def csv_to_rows(input):
     reader = get_csv_reader(input)
-    rows = [d for d in reader]
+    rows = list(iter_csv_rows(reader))
     fields = reader.fieldnames
 
-    output = {'fields': fields, 'rows': rows}
+    return {'fields': fields, 'rows': rows}
+
+
+def _to_array(values):
+    """
+    Convert a list of values to a NumPy array. Integer and floating point
+    columns are stored as ``int64`` and ``float64`` arrays respectively; any
+    other column, including one that mixes numbers and strings, is stored as an
+    array of python objects.
+    """
+    import numpy
+
+    if all(isinstance(v, six.integer_types) and not isinstance(v, bool)
+           for v in values):
+        try:
+            return numpy.array(values, dtype=numpy.int64)
+        except OverflowError:
+            pass
+    elif all(isinstance(v, six.integer_types + (float,)) and
+             not isinstance(v, bool) for v in values):
+        return numpy.array(values, dtype=numpy.float64)
+
+    # Assign into an empty array so that numpy does not try to interpret the
+    # values, e.g. turn sequences into extra dimensions.
+    array = numpy.empty(len(values), dtype=object)
+    array[:] = values
+    return array
+
+
+def _column_values(fields, rows):
+    """
+    Collect the values of each field of an iterable of rows into lists.
+    Missing values are stored as ``None``.
+    """
+    values = {field: [] for field in fields}
+    for row in rows:
+        for field in fields:
+            values[field].append(row.get(field))
+    return values
+
+
+def _read_csv(input):
+    """
+    Read CSV data as a list of field names and an iterable of rows with
+    numeric values converted, as for :py:func:`csv_to_rows`.
+    """
+    reader = get_csv_reader(input)
+    rows = iter_csv_rows(reader)
+
+    # The field names are only known once the header has been read, which
+    # happens when the first row is requested.
+    first = list(itertools.islice(rows, 1))
+    return reader.fieldnames or [], itertools.chain(first, rows)
+
+
+def rows_to_columns(fields, rows):
+    """
+    Convert a table in ``rows`` format to ``columns`` format, i.e. a dict
+    containing the ordered list of ``fields`` and a dict of ``columns`` mapping
+    each field to a one-dimensional NumPy array of its values.
+
+    :param fields: The ordered list of field names.
+    :type fields: list
+    :param rows: An iterable of rows, each a dict mapping field names to
+        values. Missing values are stored as ``None``.
+    """
+    values = _column_values(fields, rows)
+
+    return {
+        'fields': list(fields),
+        'columns': {field: _to_array(values[field]) for field in fields}
+    }
+
+
+def csv_to_columns(input):
+    return rows_to_columns(*_read_csv(input))
+
+
+def _to_arrow_array(values):
+    """
+    Convert a list of values to an Arrow array. Arrow arrays hold a single type
+    of value, so empty strings, i.e. empty CSV cells, are stored as nulls in
+    otherwise numeric columns, and a column mixing e.g. numbers and strings is
+    stored as the string representation of its values.
+    """
+    import pyarrow
+
+    errors = (TypeError, ValueError, pyarrow.ArrowException)
+    try:
+        return pyarrow.array(values)
+    except errors:
+        pass
+
+    try:
+        return pyarrow.array([None if v == '' else v for v in values])
+    except errors:
+        return pyarrow.array(
+            [None if v is None else six.text_type(v) for v in values],
+            type=pyarrow.string())
+
+
+def rows_to_arrow(fields, rows):
+    """
+    Convert a table in ``rows`` format to an Arrow table.
+
+    :param fields: The ordered list of field names.
+    :type fields: list
+    :param rows: An iterable of rows, each a dict mapping field names to
+        values. Missing values are stored as nulls.
+    :returns: A ``pyarrow.Table``.
+    """
+    import pyarrow
+
+    values = _column_values(fields, rows)
+    return pyarrow.Table.from_arrays(
+        [_to_arrow_array(values[field]) for field in fields], list(fields))
+
+
+def csv_to_arrow(input):
+    return rows_to_arrow(*_read_csv(input))
+
+
+def arrow_to_rows(table):
+    """
+    Convert an Arrow table to ``rows`` format.
+
+    :param table: The table to convert.
+    :type table: pyarrow.Table
+    """
+    fields = table.schema.names
+    columns = table.to_pydict()
+    values = [columns[field] for field in fields]
+
+    return {
+        'fields': fields,
+        'rows': [dict(zip(fields, row)) for row in zip(*values)]
+    }
+
+
+def _arrow_source(input, magic):
+    """
+    Open the contents of a binary file format for reading with Arrow. The data
+    is either the file contents itself, which Arrow reads without copying it,
+    or, if it does not start with the format's ``magic`` bytes, the path of the
+    file, as fetched for inputs with a ``filepath`` target. Files are
+    memory-mapped rather than read into memory.
+    """
+    import pyarrow
+
+    if input[:len(magic)] == magic:
+        return pyarrow.BufferReader(input)
+    return pyarrow.memory_map(input)
+
+
+def read_arrow_file(input):
+    """
+    Read a table in Arrow IPC file format.
+
+    :param input: The file contents, or the path of the file.
+    :type input: str
+    :returns: A ``pyarrow.Table``.
+    """
+    import pyarrow.ipc
+
+    return pyarrow.ipc.open_file(_arrow_source(input, 'ARROW1')).read_all()
+
+
+def write_arrow_file(table):
+    """
+    Write a table in Arrow IPC file format.
+
+    :param table: The table to write.
+    :type table: pyarrow.Table
+    :returns: The file contents.
+    """
+    import pyarrow
+
+    sink = pyarrow.BufferOutputStream()
+    writer = pyarrow.RecordBatchFileWriter(sink, table.schema)
+    writer.write_table(table)
+    writer.close()
+    return sink.getvalue().to_pybytes()
+
+
+def read_parquet(input):
+    """
+    Read a table in Parquet file format.
+
+    :param input: The file contents, or the path of the file.
+    :type input: str
+    :returns: A ``pyarrow.Table``.
+    """
+    import pyarrow.parquet
 
-    # Attempt numeric conversion
-    for row in output['rows']:
-        for col in row:
-            try:
-                row[col] = int(row[col])
-            except Exception:
-                try:
-                    orig = row[col]
-                    row[col] = float(row[col])
+    return pyarrow.parquet.read_table(_arrow_source(input, 'PAR1'))
 
-                    # Disallow NaN, Inf, -Inf since this does not
-                    # pass through JSON converters cleanly
-                    if math.isnan(row[col]) or math.isinf(row[col]):
-                        row[col] = orig
-                except Exception:
-                    pass
 
-    return output
+def write_parquet(table):
+    """
+    Write a table in Parquet file format.
+
+    :param table: The table to write.
+    :type table: pyarrow.Table
+    :returns: The file contents.
+    """
+    import pyarrow.parquet
+
+    sink = pyarrow.BufferOutputStream()
+    pyarrow.parquet.write_table(table, sink)
+    return sink.getvalue().to_pybytes()
+
+
+def clear_route_table():
+    """
+    Discard all precomputed conversion routes. This is called automatically
+    whenever nodes or edges are added to or removed from ``conv_graph``.
+    """
+    _route_table.clear()
+
+
+def get_route_table_stats():
+    """
+    Report on the effectiveness of the conversion route table.
+
+    :returns: A dict containing the number of ``hits`` and ``misses`` of
+        :py:func:`converter_path` lookups, and the current ``size`` of the
+        route table.
+    """
+    return dict(_route_stats, size=len(_route_table))
+
+
+def _find_route(source, target):
+    # We sort and pick the first of the shortest paths just to produce a stable
+    # conversion path. This is stable in regards to which plugins are loaded at
+    # the time.
+    try:
+        path = sorted(all_shortest_paths(conv_graph, source, target))[0]
+    except NetworkXNoPath:
+        return None
+    return tuple(conv_graph.edge[u][v] for (u, v) in zip(path[:-1], path[1:]))
+
+
+def build_route_table():
+    """
+    Precompute the conversion route between every pair of connected
+    validators in ``conv_graph``. The routes are identical to the ones
+    that :py:func:`converter_path` would otherwise compute on demand, i.e. the
+    lexicographically smallest of the shortest paths.
+    """
+    table = {}
+
+    for target in conv_graph.nodes_iter():
+        # Breadth-first search backwards from the target gives the distance
+        # from each node that can reach it.
+        dist = {target: 0}
+        frontier = [target]
+        while frontier:
+            next_frontier = []
+            for v in frontier:
+                for u in conv_graph.predecessors_iter(v):
+                    if u not in dist:
+                        dist[u] = dist[v] + 1
+                        next_frontier.append(u)
+            frontier = next_frontier
+
+        for source, length in dist.iteritems():
+            node, route = source, []
+            for _ in xrange(length):
+                step = min(v for v in conv_graph.successors_iter(node)
+                           if dist.get(v) == dist[node] - 1)
+                route.append(conv_graph.edge[node][step])
+                node = step
+            table[(source, target)] = tuple(route)
+
+    _route_table.clear()
+    _route_table.update(table)
 
 
 def converter_path(source, target):
@@ -100,6 +519,10 @@ def converter_path(source, target):
 
     Throws a ``NetworkXNoPath`` exception if it can not find a path.
 
+    Routes are looked up in a table built by :py:func:`build_route_table`.
+    Routes missing from the table, e.g. after the graph has been modified, are
+    computed and added to the table.
+
     :param source: Validator tuple indicating the type/format being converted
         `from`.
     :param target: ``Validator`` tuple indicating the type/format being
@@ -111,14 +534,21 @@ def converter_path(source, target):
     get_validator_analysis(source)
     get_validator_analysis(target)
 
-    # We sort and pick the first of the shortest paths just to produce a stable
-    # conversion path. This is stable in regards to which plugins are loaded at
-    # the time.
-    paths = all_shortest_paths(conv_graph, source, target)
-    path = sorted(paths)[0]
-    path = zip(path[:-1], path[1:])
+    key = (source, target)
+    if key in direct_converters:
+        return [direct_converters[key]]
+
+    if key in _route_table:
+        _route_stats['hits'] += 1
+        route = _route_table[key]
+    else:
+        _route_stats['misses'] += 1
+        route = _route_table[key] = _find_route(source, target)
 
-    return [conv_graph.edge[u][v] for (u, v) in path]
+    if route is None:
+        raise NetworkXNoPath('No path between %s and %s.' % key)
+
+    return list(route)
 
 
 def has_converter(source, target=Validator(type=None, format=None)):
@@ -134,6 +564,14 @@ def has_converter(source, target=Validator(type=None, format=None)):
     :returns: ``True`` if it can converter from ``source`` to ``target``,
         ``False`` otherwise.
     """
+    def matches(validator, v):
+        return ((validator.type is None) or (validator.type == v.type)) and \
+               ((validator.format is None) or (validator.format == v.format))
+
+    if any(matches(source, u) and matches(target, v)
+           for u, v in direct_converters):
+        return True
+
     sources = []
 
     for node in conv_graph.nodes():
@@ -185,6 +623,64 @@ def get_validator_analysis(validator):
             'No such validator %s/%s' % (validator.type, validator.format))
 
 
+def register_validator_function(validator, fn):
+    """
+    Register a plain python callable implementing a validator. When the
+    validator's analysis is a python task, :py:func:`girder_worker.isvalid`
+    will call this function directly instead of running the analysis. This
+    should be called after the validator itself has been imported.
+
+    :param validator: A ``Validator`` namedtuple
+    :param fn: A function taking the data to validate, as well as the keyword
+        arguments of the run, such as ``_tempdir`` and ``_job_manager``, and
+        returning ``True`` if the data is in the validator's type and format,
+        ``False`` otherwise.
+    :type fn: function
+    """
+    _validator_functions[validator] = (get_validator_analysis(validator), fn)
+
+
+def get_validator_function(validator):
+    """
+    Gets the callable implementing a validator, if there is one.
+
+    :param validator: A ``Validator`` namedtuple
+    :returns: The function registered for the validator, or ``None`` if the
+        validator must be run as a task.
+    """
+    analysis = get_validator_analysis(validator)
+    analysis_fn = _validator_functions.get(validator)
+
+    # The analysis may have been replaced since the function was registered
+    if (analysis_fn is None or analysis_fn[0] is not analysis or
+            analysis.get('mode', 'python') != 'python'):
+        return None
+
+    return analysis_fn[1]
+
+
+def _compile_validator(analysis):
+    """
+    Make a function running the script of a python validator analysis in the
+    same environment as a full run of the analysis would. The script is
+    compiled into the shared code cache. Returns ``None`` if the analysis can
+    not be run as a function.
+    """
+    if (analysis.get('mode', 'python') != 'python' or
+            analysis.get('write_script')):
+        return None
+
+    try:
+        code_cache.compile(analysis['script'])
+    except SyntaxError:
+        return None  # Running the analysis will report the error
+
+    def validate(data, **kwargs):
+        return run_converter(analysis, data, **kwargs)
+
+    return validate
+
+
 def import_converters(search_paths):
     """
     Import converters and validators from the specified search paths.
@@ -199,12 +695,23 @@ def import_converters(search_paths):
     ``"output"``. The input has the type and format to be checked.
     The output must have type and format ``"boolean"``. The script performs
     the validation and sets the output variable to either true or false.
+    The scripts of python validators are compiled into functions that are
+    registered with :py:func:`register_validator_function`.
 
     Any ``*_to_*.json`` files are imported as converters.
     A converter is simply an analysis with one input named ``"input"`` and one
     output named ``"output"``. The input and output should have matching
     type but should be of different formats.
 
+    A converter whose analysis sets ``"direct": true`` is only used to convert
+    directly from its input format to its output format, and never as a step
+    of a longer conversion path. This allows adding a faster conversion between
+    two formats without changing the paths taken between other formats, which
+    would otherwise go through it whenever it ties with an existing path.
+
+    No temp dir is created for python converters and validators, unless their
+    analysis sets ``"tempdir": true``.
+
     :param search_paths: A list of search paths relative to the current
         working directory. Passing a single path as a string also works.
     :type search_paths: str or list of str
@@ -222,6 +729,9 @@ def import_converters(search_paths):
                     'url': analysis['script_uri']
                 })
 
+            if analysis.get('mode', 'python') == 'python':
+                analysis.setdefault('tempdir', False)
+
         return analysis
 
     prevdir = os.getcwd()
@@ -236,9 +746,13 @@ def import_converters(search_paths):
 
             # Validators only contain 1 input and output, so the type/format of
             # it can be gleaned from the first input.
-            conv_graph.add_node(Validator(analysis['inputs'][0]['type'],
-                                          analysis['inputs'][0]['format']),
-                                analysis)
+            validator = Validator(analysis['inputs'][0]['type'],
+                                  analysis['inputs'][0]['format'])
+            conv_graph.add_node(validator, analysis)
+
+            fn = _compile_validator(analysis)
+            if fn is not None:
+                register_validator_function(validator, fn)
 
         for filename in converter_files:
             analysis = get_analysis(filename)
@@ -246,11 +760,16 @@ def import_converters(search_paths):
             in_format = analysis['inputs'][0]['format']
             out_format = analysis['outputs'][0]['format']
 
-            conv_graph.add_edge(Validator(in_type, in_format),
-                                Validator(in_type, out_format),
-                                attr_dict=analysis)
+            if analysis.get('direct'):
+                direct_converters[(Validator(in_type, in_format),
+                                   Validator(in_type, out_format))] = analysis
+            else:
+                conv_graph.add_edge(Validator(in_type, in_format),
+                                    Validator(in_type, out_format),
+                                    attr_dict=analysis)
 
     os.chdir(prevdir)
+    build_route_table()
 
 
 def print_conversion_graph():
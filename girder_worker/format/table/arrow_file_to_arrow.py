@@ -0,0 +1,3 @@
+from girder_worker.format import read_arrow_file
+
+output = read_arrow_file(input)
@@ -0,0 +1,3 @@
+from girder_worker.format import write_arrow_file
+
+output = write_arrow_file(input)
@@ -0,0 +1,11 @@
+import csv
+import six
+
+fields = input.schema.names
+columns = input.to_pydict()
+
+output = six.StringIO()
+writer = csv.writer(output)
+writer.writerow(fields)
+writer.writerows(zip(*[columns[field] for field in fields]))
+output = output.getvalue()
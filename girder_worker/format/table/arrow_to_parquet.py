@@ -0,0 +1,3 @@
+from girder_worker.format import write_parquet
+
+output = write_parquet(input)
@@ -0,0 +1,3 @@
+from girder_worker.format import arrow_to_rows
+
+output = arrow_to_rows(input)
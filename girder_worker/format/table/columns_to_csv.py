@@ -0,0 +1,11 @@
+import csv
+import six
+
+fields = input['fields']
+columns = [input['columns'][field].tolist() for field in fields]
+
+output = six.StringIO()
+writer = csv.writer(output)
+writer.writerow(fields)
+writer.writerows(zip(*columns))
+output = output.getvalue()
@@ -0,0 +1,7 @@
+fields = input['fields']
+columns = [input['columns'][field].tolist() for field in fields]
+
+output = {
+    'fields': fields,
+    'rows': [dict(zip(fields, values)) for values in zip(*columns)]
+}
@@ -0,0 +1,3 @@
+from girder_worker.format import csv_to_arrow
+
+output = csv_to_arrow(input)
@@ -0,0 +1,3 @@
+from girder_worker.format import csv_to_columns
+
+output = csv_to_columns(input)
@@ -0,0 +1,3 @@
+from girder_worker.format import read_parquet
+
+output = read_parquet(input)
@@ -0,0 +1,3 @@
+from girder_worker.format import rows_to_arrow
+
+output = rows_to_arrow(input['fields'], input['rows'])
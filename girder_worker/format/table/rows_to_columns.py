@@ -0,0 +1,3 @@
+from girder_worker.format import rows_to_columns
+
+output = rows_to_columns(input['fields'], input['rows'])
@@ -1,5 +1,5 @@
 from __future__ import absolute_import
-from . import http, local, mongodb
+from . import http, local, mongodb, pipe
 
 import os
 import tempfile
@@ -178,12 +178,18 @@ register_fetch_handler('http', http.fetch)
 register_fetch_handler('mongodb', mongodb.fetch)
 register_fetch_handler('local', local.fetch)
 register_fetch_handler('inline', _inline_fetch)
+register_fetch_handler('pipe', pipe.fetch)
 
 
 register_push_handler('http', http.push)
 register_push_handler('mongodb', mongodb.push)
 register_push_handler('local', local.push)
 register_push_handler('inline', _inline_push)
+register_push_handler('pipe', pipe.push)
 
 register_stream_push_adapter('http', http.HttpStreamPushAdapter)
 register_stream_fetch_adapter('http', http.HttpStreamFetchAdapter)
+register_stream_push_adapter('pipe', pipe.PipeStreamPushAdapter)
+register_stream_fetch_adapter('pipe', pipe.PipeStreamFetchAdapter)
+register_stream_push_adapter('local', local.LocalStreamPushAdapter)
+register_stream_fetch_adapter('local', local.LocalStreamFetchAdapter)
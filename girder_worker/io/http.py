@@ -1,12 +1,11 @@
-import httplib
 import os
 import re
-import requests
 import six
-import ssl
-import urlparse
+import sys
+import threading
 
-from girder_worker.utils import StreamFetchAdapter, StreamPushAdapter
+from girder_worker.utils import (
+    http_session, StreamFetchAdapter, StreamPushAdapter)
 
 
 class HttpStreamFetchAdapter(StreamFetchAdapter):
@@ -26,7 +25,7 @@ class HttpStreamFetchAdapter(StreamFetchAdapter):
             method = self.input_spec.get('method', 'GET').upper()
             headers = self.input_spec.get('headers', {})
             params = self.input_spec.get('params', {})
-            req = requests.request(
+            req = http_session().request(
                 method, self.input_spec['url'], headers=headers, params=params,
                 stream=True, allow_redirects=True)
             req.raise_for_status()  # we have the response headers already
@@ -39,56 +38,88 @@ class HttpStreamFetchAdapter(StreamFetchAdapter):
 
 
 class HttpStreamPushAdapter(StreamPushAdapter):
-    def __init__(self, output_spec):
+    def __init__(self, output_spec, maxsize=16):
         """
         Uses HTTP chunked transfer-encoding to stream a request body to a
-        server. Unfortunately requests does not support hooking into this logic
-        easily, so we use the lower-level httplib module.
+        server. The request is sent through the shared session of
+        :py:func:`girder_worker.utils.http_session` on a background thread,
+        which reads the body from a generator over a bounded buffer of the
+        chunks written to this adapter.
         """
         super(HttpStreamPushAdapter, self).__init__(output_spec)
+        self._queue = six.moves.queue.Queue(maxsize)
+        self._done = threading.Event()
         self._closed = False
+        self._resp = None
+        self._error = None
 
-        parts = urlparse.urlparse(output_spec['url'])
-        if parts.scheme == 'https':
-            ssl_context = ssl.create_default_context()
-            conn = httplib.HTTPSConnection(parts.netloc, context=ssl_context)
-        else:
-            conn = httplib.HTTPConnection(parts.netloc)
-
-        try:
-            conn.putrequest(output_spec.get('method', 'POST').upper(),
-                            parts.path, skip_accept_encoding=True)
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
 
-            for header, value in output_spec.get('headers', {}).items():
-                conn.putheader(header, value)
+    def _body(self):
+        while True:
+            buf = self._queue.get()
+            if buf is None:
+                return
+            yield buf
 
-            conn.putheader('Transfer-Encoding', 'chunked')
-            conn.endheaders()  # This actually flushes the headers to the server
+    def _run(self):
+        try:
+            self._resp = http_session().request(
+                self.output_spec.get('method', 'POST').upper(),
+                self.output_spec['url'],
+                headers=self.output_spec.get('headers', {}),
+                data=self._body(), allow_redirects=False)
         except Exception:
-            print('HTTP connection to "%s" failed.' % output_spec['url'])
-            conn.close()
-            raise
-
-        self.conn = conn
+            self._error = sys.exc_info()
+        finally:
+            self._done.set()
+
+    def _put(self, item):
+        while not self._done.is_set():
+            try:
+                self._queue.put(item, timeout=0.5)
+                return True
+            except six.moves.queue.Full:
+                pass
+        return False
+
+    def _finish(self):
+        """
+        Wait for the request to complete and raise if it failed.
+        """
+        self._closed = True
+        self._thread.join()
+
+        if self._error is not None:
+            print('HTTP stream output to "%s" failed.' %
+                  self.output_spec['url'])
+            e = self._error
+            raise e[0], e[1], e[2]
+
+        resp = self._resp
+        if resp.status_code >= 300 and resp.status_code < 400:
+            raise Exception(
+                'Redirects are not supported for streaming requests at this '
+                'time. %d to Location: %s' % (
+                    resp.status_code, resp.headers.get('Location')))
+        if resp.status_code >= 400:
+            raise Exception(
+                'HTTP stream output to %s failed with status %d. Response '
+                'was: %s' % (
+                    self.output_spec['url'], resp.status_code, resp.text))
 
     def write(self, buf):
         """
-        Write a chunk of data to the output stream in accordance with the
-        chunked transfer encoding protocol.
+        Write a chunk of data to the output stream. An empty chunk would end
+        the chunked transfer-encoding, so it is skipped.
         """
-        try:
-            self.conn.send(hex(len(buf))[2:].encode('utf-8'))
-            self.conn.send(b'\r\n')
-            self.conn.send(buf)
-            self.conn.send(b'\r\n')
-        except Exception:
-            resp = self.conn.getresponse()
-            print('Exception while sending HTTP chunk to %s, status was %s, '
-                  'message was:\n%s' % (self.output_spec['url'], resp.status,
-                                        resp.read()))
-            self.conn.close()
-            self._closed = True
-            raise
+        if buf and not self._put(buf):
+            # The request ended before the body was sent
+            self._finish()
+            raise Exception('HTTP stream output to %s ended early.' %
+                            self.output_spec['url'])
 
     def close(self):
         """
@@ -97,20 +128,8 @@ class HttpStreamPushAdapter(StreamPushAdapter):
         if self._closed:
             return
 
-        try:
-            self.conn.send(b'0\r\n\r\n')
-            resp = self.conn.getresponse()
-            if resp.status >= 300 and resp.status < 400:
-                raise Exception('Redirects are not supported for streaming '
-                                'requests at this time. %d to Location: %s' % (
-                                    resp.status, resp.getheader('Location')))
-            if resp.status >= 400:
-                raise Exception(
-                    'HTTP stream output to %s failed with status %d. Response '
-                    'was: %s' % (
-                        self.output_spec['url'], resp.status, resp.read()))
-        finally:
-            self.conn.close()
+        self._put(None)
+        self._finish()
 
 
 def _read_filename_from_resp(request, url):
@@ -138,9 +157,9 @@ def fetch(spec, **kwargs):
     target = task_input.get('target', 'memory')
     url = spec['url']
     method = spec.get('method', 'GET').upper()
-    request = requests.request(method, url, headers=spec.get('headers', {}),
-                               params=spec.get('params', {}),
-                               stream=True, allow_redirects=True)
+    request = http_session().request(
+        method, url, headers=spec.get('headers', {}),
+        params=spec.get('params', {}), stream=True, allow_redirects=True)
 
     try:
         request.raise_for_status()
@@ -148,6 +167,11 @@ def fetch(spec, **kwargs):
         print 'HTTP fetch failed (%s). Response: %s' % (url, request.text)
         raise
 
+    # Record the version of the data, e.g. to identify it in the step cache
+    fetch_info = kwargs.get('_fetch_info')
+    if fetch_info is not None and 'ETag' in request.headers:
+        fetch_info['etag'] = request.headers['ETag']
+
     if target == 'filepath':
         tmpDir = kwargs['_tempdir']
 
@@ -186,11 +210,11 @@ def push(data, spec, **kwargs):
 
     if target == 'filepath':
         with open(data, 'rb') as fd:
-            request = requests.request(
+            request = http_session().request(
                 method, url, headers=spec.get('headers', {}), data=fd,
                 allow_redirects=True)
     elif target == 'memory':
-        request = requests.request(
+        request = http_session().request(
             method, url, headers=spec.get('headers', {}), data=data,
             allow_redirects=True)
     else:
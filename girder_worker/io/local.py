@@ -1,9 +1,230 @@
+import ctypes
+import ctypes.util
+import errno
+import fcntl
+import os
+import shutil
+import sys
+import tempfile
+
+from girder_worker.utils import StreamFetchAdapter, StreamPushAdapter
+
+
+def _libc_function(name, restype, *argtypes):
+    """
+    Look up a Linux system call wrapper in libc, since ``os`` does not expose
+    ``sendfile`` or ``splice`` in python 2. Returns ``None`` where it is not
+    available, in which case the adapters copy the data themselves.
+    """
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        fn = getattr(libc, name)
+    except (OSError, AttributeError):
+        return None
+    fn.restype = restype
+    fn.argtypes = argtypes
+    return fn
+
+
+_sendfile = _libc_function(
+    'sendfile', ctypes.c_ssize_t, ctypes.c_int, ctypes.c_int, ctypes.c_void_p,
+    ctypes.c_size_t)
+_splice = _libc_function(
+    'splice', ctypes.c_ssize_t, ctypes.c_int, ctypes.c_void_p, ctypes.c_int,
+    ctypes.c_void_p, ctypes.c_size_t, ctypes.c_uint)
+
+# Errors meaning that the kernel cannot move data between the given
+# descriptors, e.g. because of the type of filesystem.
+_UNSUPPORTED = (errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP)
+
+
+def _call(fn, *args):
+    n = fn(*args)
+    if n < 0:
+        e = ctypes.get_errno()
+        raise OSError(e, os.strerror(e))
+    return n
+
+
+class LocalStreamFetchAdapter(StreamFetchAdapter):
+    """
+    Reads a stream from a file on the local filesystem, given in
+    ``spec['path']``. When streamed into a pipe by
+    :py:func:`girder_worker.utils.run_process`, the data is copied by the
+    kernel via ``sendfile`` where possible, rather than through python.
+    """
+    def __init__(self, input_spec):
+        super(LocalStreamFetchAdapter, self).__init__(input_spec)
+        self._file = open(input_spec['path'], 'rb', 0)
+        self._zero_copy = _sendfile is not None
+
+    def read(self, buf_len):
+        buf = self._file.read(buf_len)
+        if not buf:
+            self._file.close()
+        return buf
+
+    def transfer(self, fd, buf_len):
+        if self._file.closed:
+            return 0
+
+        n = None
+        if self._zero_copy:
+            try:
+                n = _call(_sendfile, fd, self._file.fileno(), None, buf_len)
+            except OSError as e:
+                if e.errno not in _UNSUPPORTED:
+                    raise
+                self._zero_copy = False
+
+        if n is None:
+            n = self._copy(fd, buf_len)
+        if not n:
+            self._file.close()
+        return n
+
+    def _copy(self, fd, buf_len):
+        buf = self._file.read(buf_len)
+        if not buf:
+            return 0
+
+        # Seek back over the data that could not be written to the pipe, so
+        # that it is read again next time.
+        try:
+            written = os.write(fd, buf)
+        except OSError:
+            self._file.seek(-len(buf), os.SEEK_CUR)
+            raise
+        self._file.seek(written - len(buf), os.SEEK_CUR)
+        return written
+
+
+class LocalStreamPushAdapter(StreamPushAdapter):
+    """
+    Writes a stream to a file on the local filesystem, given in
+    ``spec['path']``. When streamed from a pipe by
+    :py:func:`girder_worker.utils.run_process`, the data is moved by the
+    kernel via ``splice`` where possible, rather than through python.
+    """
+    def __init__(self, output_spec):
+        super(LocalStreamPushAdapter, self).__init__(output_spec)
+        self._file = open(output_spec['path'], 'wb', 0)
+        self._zero_copy = _splice is not None
+
+    def write(self, buf):
+        self._file.write(buf)
+
+    def transfer(self, fd, buf_len):
+        if self._zero_copy:
+            try:
+                return _call(
+                    _splice, fd, None, self._file.fileno(), None, buf_len, 0)
+            except OSError as e:
+                if e.errno not in _UNSUPPORTED:
+                    raise
+                self._zero_copy = False
+
+        buf = os.read(fd, buf_len)
+        self.write(buf)
+        return len(buf)
+
+    def close(self):
+        self._file.close()
+
+
+# The ioctl that makes a file share the data of another one, copy-on-write
+_FICLONE = 0x40049409
+
+
+def _reflink(src, dst):
+    if not sys.platform.startswith('linux'):
+        raise OSError(errno.ENOSYS, 'Reflinks are not supported')
+
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), _FICLONE, fsrc.fileno())
+        except IOError as e:
+            raise OSError(e.errno, e.strerror)
+
+
+def _hardlink(src, dst):
+    # A task writing to a hard link would modify the original file, so only
+    # files that nobody may write to, and whose mode this process cannot change
+    # as their owner, are linked. Permission checks such as os.access would
+    # always succeed for root.
+    st = os.stat(src)
+    if st.st_mode & 0o222 or st.st_uid == os.geteuid():
+        raise OSError(errno.EACCES, 'The file is writable')
+    os.link(src, dst)
+
+
+def link_file(src, dst, hardlink=True):
+    """
+    Make the file ``src`` available at the path ``dst`` without copying its
+    data where possible, while keeping the original file from being modified
+    through ``dst``. This tries a reflink, which shares the data copy-on-write
+    and so behaves like a copy, and then, if ``src`` has no write permission
+    bits set and is not owned by the current user, a hard link. Otherwise the
+    file is copied. Symbolic links are never used, as they would not resolve
+    inside of e.g. docker containers.
+
+    :param src: The path of the existing file.
+    :type src: str
+    :param dst: The path at which to make the file available. It is replaced
+        if it exists.
+    :type dst: str
+    :param hardlink: Whether hard links may be used. Pass ``False`` if ``dst``
+        is accessed by processes that ignore permission bits, such as docker
+        containers running as root.
+    :type hardlink: bool
+    :returns: How the file was made available, i.e. ``'reflink'``,
+        ``'hardlink'`` or ``'copy'``.
+    """
+    methods = [('reflink', _reflink)]
+    if hardlink:
+        methods.append(('hardlink', _hardlink))
+
+    for method, fn in methods:
+        if os.path.lexists(dst):
+            os.remove(dst)
+        try:
+            fn(src, dst)
+            return method
+        except (OSError, AttributeError):
+            pass  # e.g. another filesystem, or not supported by this one
+
+    if os.path.lexists(dst):
+        os.remove(dst)
+    shutil.copyfile(src, dst)
+    return 'copy'
+
+
 def fetch(spec, **kwargs):
     """
-    Fetches a file on the local filesystem into memory.
+    Fetches a file on the local filesystem. If the task input has a
+    ``filepath`` target, the file is linked into the temp directory of the task
+    rather than copied, see :py:func:`link_file`. Unless a ``filename`` is
+    given, each input is placed in a directory of its own, so that files with
+    the same name do not collide. Otherwise it is read into memory.
     """
-    with open(spec['path'], 'rb') as f:
-        return f.read()
+    task_input = kwargs.get('task_input', {})
+    target = task_input.get('target', 'memory')
+
+    if target == 'filepath':
+        if 'filename' in task_input:
+            path = os.path.join(kwargs['_tempdir'], task_input['filename'])
+        else:
+            path = os.path.join(tempfile.mkdtemp(dir=kwargs['_tempdir']),
+                                os.path.basename(spec['path']))
+        link_file(spec['path'], path)
+        return path
+    elif target == 'memory':
+        with open(spec['path'], 'rb') as f:
+            return f.read()
+    else:
+        raise Exception('Invalid local fetch target: ' + target)
 
 
 def push(data, spec, **kwargs):
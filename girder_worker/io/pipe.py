@@ -0,0 +1,49 @@
+import os
+
+from girder_worker.utils import StreamFetchAdapter, StreamPushAdapter
+
+
+class PipeStreamFetchAdapter(StreamFetchAdapter):
+    """
+    Reads a stream from the read end of a pipe, given as an unbuffered file
+    object in ``spec['pipe']``. This is used to stream data between the steps
+    of a workflow, which run concurrently.
+    """
+    def read(self, buf_len):
+        pipe = self.input_spec['pipe']
+        if pipe.closed:
+            return b''
+
+        buf = os.read(pipe.fileno(), buf_len)
+        if not buf:
+            pipe.close()
+        return buf
+
+
+class PipeStreamPushAdapter(StreamPushAdapter):
+    """
+    Writes a stream to the write end of a pipe, given as an unbuffered file
+    object in ``spec['pipe']``. The pipe is closed along with the stream, so
+    that the reading end sees the end of the stream.
+    """
+    def write(self, buf):
+        self.output_spec['pipe'].write(buf)
+
+    def close(self):
+        self.output_spec['pipe'].close()
+
+
+def fetch(spec, **kwargs):
+    """
+    Reads the entire contents of a pipe into memory.
+    """
+    with spec['pipe'] as pipe:
+        return pipe.read()
+
+
+def push(data, spec, **kwargs):
+    """
+    Writes a blob of data in memory to a pipe, then closes it.
+    """
+    with spec['pipe'] as pipe:
+        pipe.write(data)
@@ -1,16 +1,26 @@
+import errno
+import fcntl
 import json
 import os
 import re
 import subprocess
+import tempfile
+import threading
+import time
 
+from celery.utils.log import get_logger
 from girder_worker import config, TaskSpecValidationError, utils
 from girder_worker.io import make_stream_fetch_adapter, make_stream_push_adapter
+from girder_worker.io.local import link_file
+from .image_cache import ImageCache
 
 DATA_VOLUME = '/mnt/girder_worker/data'
 SCRIPTS_VOLUME = '/mnt/girder_worker/scripts'
 SCRIPTS_DIR = os.path.join(os.path.abspath(os.path.dirname(__file__)),
                            'scripts')
 
+logger = get_logger(__name__)
+
 
 def _pull_image(image):
     """
@@ -29,6 +39,21 @@ def _pull_image(image):
         raise Exception('Docker pull returned code {}.'.format(p.returncode))
 
 
+def _inspect_image(image):
+    """
+    Returns the metadata of a Docker image on this worker that is needed to run
+    it, i.e. its ID, repository digests and entry point.
+    """
+    info = json.loads(subprocess.check_output(
+        args=['docker', 'inspect', '--type=image', image]))[0]
+
+    return {
+        'id': info.get('Id'),
+        'digests': info.get('RepoDigests', []),
+        'entrypoint': info['Config']['Entrypoint']
+    }
+
+
 def _read_from_config(key, default):
     """
     Helper to read Docker specific config values from the worker config files.
@@ -39,6 +64,61 @@ def _read_from_config(key, default):
         return default
 
 
+_image_cache = None
+
+
+def _get_image_cache():
+    """
+    Returns the image metadata cache configured by the ``image_cache_ttl`` and
+    ``image_cache_file`` options of the ``docker`` config section, or ``None``
+    if the cache is disabled, which is the default.
+    """
+    global _image_cache
+
+    ttl = float(_read_from_config('image_cache_ttl', 0))
+    if ttl <= 0:
+        return None
+
+    path = os.path.abspath(_read_from_config(
+        'image_cache_file', os.path.join(
+            config.get('girder_worker', 'tmp_root'), 'docker_images.json')))
+    if _image_cache is None or _image_cache.path != path:
+        _image_cache = ImageCache(path, ttl)
+    _image_cache.ttl = ttl
+    return _image_cache
+
+
+def _prepare_image(task):
+    """
+    Pulls the image of a task unless it is disabled by ``pull_image`` or the
+    image was pulled recently according to the image cache. Returns the
+    metadata of the image if it is needed to run the task, i.e. if the task
+    uses the image's entry point, or ``None`` otherwise.
+    """
+    image = task['docker_image']
+    cache = _get_image_cache()
+    info = cache.get(image) if cache else None
+
+    pulled = False
+    if task.get('pull_image', True):
+        if info is None:
+            print('Pulling Docker image: ' + image)
+            _pull_image(image)
+            pulled = True
+        else:
+            print('Using recently pulled Docker image: ' + image)
+
+    # Record the metadata of images that were just pulled, even if the task
+    # does not need it, so that later tasks can skip pulling them.
+    if info is None and ('entrypoint' not in task or
+                         (pulled and cache is not None)):
+        info = _inspect_image(image)
+        if cache is not None:
+            cache.put(image, info)
+
+    return info
+
+
 def _transform_path(inputs, taskInputs, inputId, tmpDir):
     """
     If the input specified by inputId is a filepath target, we transform it to
@@ -48,7 +128,19 @@ def _transform_path(inputs, taskInputs, inputId, tmpDir):
         tiId = ti['id'] if 'id' in ti else ti['name']
         if tiId == inputId:
             if ti.get('target') == 'filepath':
-                rel = os.path.relpath(inputs[inputId]['script_data'], tmpDir)
+                path = inputs[inputId]['script_data']
+                rel = os.path.relpath(path, tmpDir)
+                if rel.split(os.sep)[0] == os.pardir:
+                    # Files outside of the temp dir of the task, e.g. outputs
+                    # of other steps of a workflow, are not mounted into the
+                    # container, so they are linked into the temp dir. The
+                    # container may run as root, so they are never hard linked.
+                    utils.ensure_tmpdir(tmpDir)
+                    linkdir = tempfile.mkdtemp(dir=tmpDir)
+                    link_file(path, os.path.join(
+                        linkdir, os.path.basename(path)), hardlink=False)
+                    rel = os.path.join(os.path.basename(linkdir),
+                                       os.path.basename(path))
                 return os.path.join(DATA_VOLUME, rel)
             else:
                 return inputs[inputId]['script_data']
@@ -124,6 +216,94 @@ def _docker_gc(tempdir):
     return subprocess.Popen(args=(script,), env=env)
 
 
+def _gc_due(gc_dir):
+    """
+    Determine whether Docker garbage collection should be run, i.e. whether
+    the last garbage collection on this host was at least ``gc_interval``
+    seconds ago, or the disk usage of ``gc_disk_path`` exceeds
+    ``gc_disk_threshold`` percent.
+    """
+    threshold = float(_read_from_config('gc_disk_threshold', 0))
+    if threshold > 0:
+        st = os.statvfs(_read_from_config('gc_disk_path', '/var/lib/docker'))
+        if st.f_blocks and 100.0 * (
+                1 - float(st.f_bavail) / st.f_blocks) >= threshold:
+            return True
+
+    interval = float(_read_from_config('gc_interval', 0))
+    try:
+        last_run = os.path.getmtime(os.path.join(gc_dir, 'last_run'))
+    except OSError:
+        return True
+    return time.time() - last_run >= interval
+
+
+def _lock_gc_dir(gc_dir):
+    """
+    Try to take the exclusive lock on the GC scratch directory that is held
+    while garbage collection runs. Returns the locked file, which releases the
+    lock when it is closed, or ``None`` if the lock is held by another worker
+    process or thread.
+    """
+    fd = open(os.path.join(gc_dir, 'lock'), 'a')
+    # Containers started while the GC runs must not inherit the lock
+    utils._set_cloexec(fd.fileno())
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except IOError as e:
+        fd.close()
+        if e.errno in (errno.EACCES, errno.EAGAIN):
+            return None
+        raise
+    return fd
+
+
+def _wait_for_gc(p, lock):
+    try:
+        p.wait()
+        if p.returncode != 0:
+            logger.error('Docker GC returned code %d.', p.returncode)
+    finally:
+        lock.close()
+
+
+def _schedule_docker_gc():
+    """
+    Starts Docker garbage collection in the background if it is due, and it is
+    not already running on this host. Worker processes on the host share the
+    scratch directory under ``tmp_root``, which is locked while garbage
+    collection runs, and the time at which it was last started through the
+    mtime of a file in that directory.
+    """
+    gc_dir = os.path.join(os.path.abspath(
+        config.get('girder_worker', 'tmp_root')), 'docker_gc_scratch')
+    utils._makedirs(gc_dir)
+
+    lock = _lock_gc_dir(gc_dir)
+    if lock is None:
+        return
+
+    try:
+        if not _gc_due(gc_dir):
+            lock.close()
+            return
+
+        with open(os.path.join(gc_dir, 'last_run'), 'w'):
+            pass  # Update the mtime
+
+        print('Garbage collecting old containers and images.')
+        p = _docker_gc(gc_dir)
+    except Exception:
+        lock.close()
+        raise
+
+    # Reap the subprocess and release the lock once it is done, without
+    # blocking the task
+    thread = threading.Thread(target=_wait_for_gc, args=(p, lock))
+    thread.daemon = True
+    thread.start()
+
+
 def validate_task_outputs(task_outputs):
     """
     This is called prior to fetching inputs to make sure the output specs are
@@ -144,11 +324,13 @@ def validate_task_outputs(task_outputs):
                 'filepath-target outputs.')
 
 
-def _get_pre_args(task, uid, gid):
+def _get_pre_args(task, uid, gid, image_info):
     """
     When using our entrypoint.sh script, we have to detect the existing entry
     point and munge the args to make the behavior equivalent. This returns
     the list of arguments that should go prior to the client-specified args.
+    The existing entry point is read from ``image_info``, as returned by
+    :py:func:`_prepare_image`.
     """
     args = [str(uid), str(gid)]
 
@@ -158,10 +340,8 @@ def _get_pre_args(task, uid, gid):
         else:
             args.append(task['entrypoint'])
     else:
-        # Read entrypoint from container if default is used
-        info = json.loads(subprocess.check_output(
-            args=['docker', 'inspect', '--type=image', task['docker_image']]))
-        args.extend(info[0]['Config']['Entrypoint'])
+        # Use the entrypoint of the image if default is used
+        args.extend(image_info['entrypoint'])
 
     return args
 
@@ -229,10 +409,7 @@ def _setup_pipes(task_inputs, inputs, task_outputs, outputs, tempdir):
 
 def run(task, inputs, outputs, task_inputs, task_outputs, **kwargs):
     image = task['docker_image']
-
-    if task.get('pull_image', True):
-        print('Pulling Docker image: ' + image)
-        _pull_image(image)
+    image_info = _prepare_image(task)
 
     tempdir = kwargs.get('_tempdir')
     args = _expand_args(task.get('container_args', []), inputs, task_inputs,
@@ -241,7 +418,7 @@ def run(task, inputs, outputs, task_inputs, task_outputs, **kwargs):
     ipipes, opipes = _setup_pipes(
         task_inputs, inputs, task_outputs, outputs, tempdir)
 
-    pre_args = _get_pre_args(task, os.getuid(), os.getgid())
+    pre_args = _get_pre_args(task, os.getuid(), os.getgid(), image_info)
     command = [
         'docker', 'run',
         '-v', '%s:%s' % (tempdir, DATA_VOLUME),
@@ -256,10 +433,7 @@ def run(task, inputs, outputs, task_inputs, task_outputs, **kwargs):
     if p.returncode != 0:
         raise Exception('Error: docker run returned code %d.' % p.returncode)
 
-    print('Garbage collecting old containers and images.')
-    gc_dir = os.path.join(tempdir, 'docker_gc_scratch')
-    os.mkdir(gc_dir)
-    p = _docker_gc(gc_dir)
+    _schedule_docker_gc()
 
     for name, spec in task_outputs.iteritems():
         if spec.get('target') == 'filepath' and not spec.get('stream'):
@@ -273,8 +447,3 @@ def run(task, inputs, outputs, task_inputs, task_outputs, **kwargs):
             if not os.path.exists(path):
                 raise Exception('Output filepath %s does not exist.' % path)
             outputs[name]['script_data'] = path
-
-    p.wait()  # Wait for garbage collection subprocess to finish
-
-    if p.returncode != 0:
-        raise Exception('Docker GC returned code %d.' % p.returncode)
@@ -0,0 +1,97 @@
+import contextlib
+import fcntl
+import json
+import os
+import tempfile
+import threading
+import time
+
+from girder_worker.utils import _makedirs
+
+
+class ImageCache(object):
+    """
+    Metadata of the Docker images run by tasks, i.e. their ID, digests and
+    entry point, keyed by image reference. The cache is stored in a JSON file
+    shared by all worker processes on the host. While the entry of an image is
+    fresh, tasks need not pull or inspect the image again.
+    """
+    def __init__(self, path, ttl):
+        """
+        :param path: The path of the JSON file in which to store the cache.
+        :type path: str
+        :param ttl: The number of seconds for which an entry stays fresh.
+            Entries of images referenced by digest, e.g.
+            ``debian@sha256:...``, never go stale since such images cannot
+            change, but are only used if they record that digest.
+        :type ttl: float
+        """
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+
+        _makedirs(os.path.dirname(path))
+
+    @contextlib.contextmanager
+    def _locked(self):
+        """
+        Lock the cache against changes by other threads and processes.
+        """
+        with self._lock, open(self.path + '.lock', 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            yield
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {}
+
+    def get(self, image):
+        """
+        Return the metadata of an image, or ``None`` if it is not in the cache
+        or is stale.
+
+        :param image: The image reference, e.g. ``girder/worker:latest``.
+        :type image: str
+        """
+        with self._lock:
+            entry = self._load().get(image)
+
+        if entry is None:
+            return None
+        if '@' in image:
+            digest = image.split('@', 1)[1]
+            if digest not in [d.split('@', 1)[-1]
+                              for d in entry.get('digests', ())]:
+                return None
+        elif time.time() - entry['time'] >= self.ttl:
+            return None
+        return entry
+
+    def put(self, image, entry):
+        """
+        Store the metadata of an image that was just pulled or inspected.
+
+        :param image: The image reference.
+        :type image: str
+        :param entry: The metadata, as returned by ``docker inspect``.
+        :type entry: dict
+        """
+        with self._locked():
+            entries = self._load()
+            entries[image] = dict(entry, time=time.time())
+
+            # Write to a temp file and rename it so that other processes never
+            # read a partially written cache.
+            fd, tmp = tempfile.mkstemp(
+                dir=os.path.dirname(self.path), suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(entries, f)
+            os.rename(tmp, self.path)
+
+    def clear(self):
+        with self._locked():
+            if os.path.exists(self.path):
+                os.remove(self.path)
@@ -1,4 +1,5 @@
 import ConfigParser
+import errno
 import girder_worker
 import httmock
 import json
@@ -8,9 +9,11 @@ import shutil
 import six
 import stat
 import sys
+import time
 import unittest
 
 from girder_worker import io, TaskSpecValidationError
+from girder_worker.plugins.docker import executor
 from girder_worker.plugins.docker.executor import DATA_VOLUME, SCRIPTS_VOLUME,\
     SCRIPTS_DIR
 
@@ -35,10 +38,10 @@ inspectOutput = json.dumps([{
 }], indent=4)
 
 
-# Monkey patch select.select in the docker task module
-def _mockSelect(r, w, x, *args, **kwargs):
-    return r, w, x
-girder_worker.utils.select.select = _mockSelect
+# Monkey patch waiting on pipes in the docker task module
+def _mockWaitForPipes(r, w, *args, **kwargs):
+    return r, w
+girder_worker.utils._wait_for_pipes = _mockWaitForPipes
 
 
 # Monkey patch os.read to simulate subprocess stdout and stderr
@@ -326,3 +329,168 @@ class TestDockerMode(unittest.TestCase):
         pipe = os.path.join(tmp, 'named_pipe')
         self.assertTrue(os.path.exists(pipe))
         self.assertTrue(stat.S_ISFIFO(os.stat(pipe).st_mode))
+
+    @mock.patch('girder_worker.utils.run_process')
+    @mock.patch('subprocess.Popen')
+    @mock.patch('subprocess.check_output')
+    def testImageCache(self, mockCheckOutput, mockPopen, mockRunProcess):
+        mockRunProcess.return_value = processMock
+        mockPopen.return_value = processMock
+        mockCheckOutput.return_value = inspectOutput
+
+        task = {
+            'mode': 'docker',
+            'docker_image': 'test/test:latest',
+            'inputs': [],
+            'outputs': []
+        }
+
+        cache_file = os.path.join(_tmp, 'images.json')
+        girder_worker.config.set('docker', 'image_cache_ttl', '3600')
+        girder_worker.config.set('docker', 'image_cache_file', cache_file)
+        try:
+            for _ in range(2):
+                girder_worker.run(task, inputs={}, cleanup=False)
+
+            # The image is only pulled and inspected by the first task
+            cmds = [x[1]['args'] for x in mockPopen.call_args_list]
+            self.assertEqual(
+                cmds.count(('docker', 'pull', 'test/test:latest')), 1)
+            self.assertEqual(mockCheckOutput.call_count, 1)
+
+            cmd = mockRunProcess.call_args_list[1][0][0]
+            self.assertEqual(cmd[-2:], ['/usr/bin/foo', '--flag'])
+
+            with open(cache_file) as f:
+                entry = json.load(f)['test/test:latest']
+            self.assertEqual(entry['entrypoint'], ['/usr/bin/foo', '--flag'])
+
+            # Images referenced by digest are only skipped if the cached
+            # entry records that digest
+            image = 'test/test@sha256:' + 'a' * 64
+            task['docker_image'] = image
+            info = json.loads(inspectOutput)
+            info[0]['RepoDigests'] = [image]
+            mockCheckOutput.return_value = json.dumps(info)
+            cache = executor._get_image_cache()
+            cache.put(image, dict(entry, digests=[
+                'test/test@sha256:' + 'b' * 64]))
+            for _ in range(2):
+                girder_worker.run(task, inputs={}, cleanup=False)
+            cmds = [x[1]['args'] for x in mockPopen.call_args_list]
+            self.assertEqual(cmds.count(('docker', 'pull', image)), 1)
+            self.assertEqual(cache.get(image)['digests'], [image])
+
+            # Concurrent updates by several processes are not lost
+            pids = []
+            for i in range(4):
+                pid = os.fork()
+                if not pid:
+                    try:
+                        for j in range(20):
+                            cache.put('image%d:%d' % (i, j), entry)
+                    finally:
+                        os._exit(0)
+                pids.append(pid)
+            for pid in pids:
+                os.waitpid(pid, 0)
+            for i in range(4):
+                for j in range(20):
+                    self.assertIsNotNone(cache.get('image%d:%d' % (i, j)))
+        finally:
+            girder_worker.config.remove_option('docker', 'image_cache_ttl')
+            girder_worker.config.remove_option('docker', 'image_cache_file')
+
+    @mock.patch('girder_worker.utils.run_process')
+    @mock.patch('subprocess.Popen')
+    @mock.patch('subprocess.check_output')
+    def testGcInterval(self, mockCheckOutput, mockPopen, mockRunProcess):
+        mockRunProcess.return_value = processMock
+        mockPopen.return_value = processMock
+        mockCheckOutput.return_value = inspectOutput
+
+        task = {
+            'mode': 'docker',
+            'docker_image': 'test/test:latest',
+            'pull_image': False,
+            'inputs': [],
+            'outputs': []
+        }
+
+        last_run = os.path.join(_tmp, 'docker_gc_scratch', 'last_run')
+        if os.path.exists(last_run):
+            os.remove(last_run)
+
+        girder_worker.config.set('docker', 'gc_interval', '3600')
+        try:
+            for _ in range(2):
+                girder_worker.run(task, inputs={}, cleanup=False)
+        finally:
+            girder_worker.config.remove_option('docker', 'gc_interval')
+
+        # Garbage collection only ran after the first task
+        self.assertEqual(mockPopen.call_count, 1)
+        six.assertRegex(self, mockPopen.call_args[1]['args'][0], 'docker-gc$')
+        self.assertTrue(os.path.exists(last_run))
+
+    @mock.patch('subprocess.Popen')
+    def testGcLock(self, mockPopen):
+        failedProcess = mock.Mock(returncode=1)
+        mockPopen.return_value = failedProcess
+
+        gc_dir = os.path.join(_tmp, 'docker_gc_scratch')
+        last_run = os.path.join(gc_dir, 'last_run')
+        if os.path.exists(last_run):
+            os.remove(last_run)
+
+        # Garbage collection is skipped while another worker holds the lock
+        lock = executor._lock_gc_dir(gc_dir)
+        self.assertIsNotNone(lock)
+        try:
+            executor._schedule_docker_gc()
+        finally:
+            lock.close()
+        self.assertEqual(mockPopen.call_count, 0)
+        self.assertFalse(os.path.exists(last_run))
+
+        # Failures are logged, and the lock is released once the GC is done
+        with mock.patch.object(executor, 'logger') as logger:
+            executor._schedule_docker_gc()
+            for _ in range(100):
+                lock = executor._lock_gc_dir(gc_dir)
+                if lock is not None:
+                    break
+                time.sleep(0.05)
+        self.assertIsNotNone(lock)
+        lock.close()
+        self.assertEqual(mockPopen.call_count, 1)
+        failedProcess.wait.assert_called_once_with()
+        logger.error.assert_called_once_with('Docker GC returned code %d.', 1)
+
+    def testTransformPath(self):
+        tmpDir = os.path.join(_tmp, 'transform')
+        path = os.path.join(_tmp, 'readonly.txt')
+        with open(path, 'w') as f:
+            f.write('data')
+        os.chmod(path, 0o444)
+
+        # Files outside of the temp dir are made available in it, but never
+        # hard linked, as a container running as root could write to them
+        inputs = {'file': {'script_data': path}}
+        taskInputs = {'file': {'id': 'file', 'target': 'filepath'}}
+        try:
+            with mock.patch('girder_worker.io.local._reflink',
+                            side_effect=OSError(errno.EXDEV, 'Cross')), \
+                    mock.patch('os.geteuid',
+                               return_value=os.stat(path).st_uid + 1):
+                transformed = executor._transform_path(
+                    inputs, taskInputs, 'file', tmpDir)
+            self.assertTrue(transformed.startswith(DATA_VOLUME + '/'))
+            local = os.path.join(
+                tmpDir, os.path.relpath(transformed, DATA_VOLUME))
+            self.assertFalse(os.path.samefile(local, path))
+            with open(local) as f:
+                self.assertEqual(f.read(), 'data')
+        finally:
+            os.remove(path)
+            shutil.rmtree(tmpDir, ignore_errors=True)
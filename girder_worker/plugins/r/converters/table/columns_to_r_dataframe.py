@@ -0,0 +1,3 @@
+from girder_worker.plugins.r.dataframe import columns_to_dataframe
+
+output = columns_to_dataframe(input)
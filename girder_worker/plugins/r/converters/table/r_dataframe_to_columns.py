@@ -0,0 +1,3 @@
+from girder_worker.plugins.r.dataframe import dataframe_to_columns
+
+output = dataframe_to_columns(input)
@@ -0,0 +1,149 @@
+import numpy
+import rpy2.rinterface
+import rpy2.robjects
+import six
+
+from .executor import _lock
+
+# R integers are 32 bit, and the smallest one represents NA_integer_
+_NA_INTEGER = -2 ** 31
+_INT_MAX = 2 ** 31 - 1
+
+# Set the row names of a data frame from its first column if its values are
+# unique, and replace empty column names, as when reading CSV data in R.
+_finish_dataframe = """
+    function (df) {
+        names(df) <- gsub("^$", "X", names(df))
+        if (ncol(df) > 0 && anyDuplicated(df[,1]) == 0) {
+            row.names(df) <- df[,1]
+        }
+        df
+    }
+    """
+
+
+# Convert a character vector to the type read.csv would give a column of the
+# same text, e.g. to numbers, logicals, or, depending on the version of R,
+# factors. Blank fields are NA unless the column stays character.
+_type_convert = """
+    function (x) {
+        type.convert(x, as.is=!eval(formals(read.table)$stringsAsFactors))
+    }
+    """
+
+# Values that read.csv reads as NA in numeric and logical columns
+_NA_VALUES = (None, '', 'NA')
+
+
+def _is_number(value):
+    return (isinstance(value, six.integer_types + (float,)) and
+            not isinstance(value, bool))
+
+
+def _is_na(value):
+    return isinstance(value, six.string_types + (type(None),)) and \
+        value in _NA_VALUES
+
+
+def _text(value):
+    return repr(value) if isinstance(value, float) else six.text_type(value)
+
+
+def _to_vector(array):
+    """
+    Convert a one-dimensional NumPy array to an R vector. Numeric arrays are
+    copied straight from their buffer, without converting each value to a
+    python object. Other arrays are converted as if they had been written to
+    CSV and read with ``read.csv``, so that a table gives the same data frame
+    whether or not it is converted through CSV.
+    """
+    ri = rpy2.rinterface
+
+    if array.dtype.kind == 'f':
+        return ri.SexpVector(array.astype(numpy.float64), ri.REALSXP)
+
+    if array.dtype.kind in 'iu':
+        if len(array) and (array.min() <= _NA_INTEGER or
+                           array.max() > _INT_MAX):
+            return ri.SexpVector(array.astype(numpy.float64), ri.REALSXP)
+        return ri.SexpVector(array.astype(numpy.int32), ri.INTSXP)
+
+    # Missing values, e.g. the empty cells of CSV data, become NA, as they do
+    # with read.csv.
+    values = list(array)
+    if all(_is_na(v) or _is_number(v) for v in values):
+        return rpy2.robjects.FloatVector(
+            [ri.NA_Real if _is_na(v) else v for v in values])
+    return rpy2.robjects.r(_type_convert)(rpy2.robjects.StrVector(
+        [ri.NA_Character if v is None else _text(v) for v in values]))
+
+
+def _with_missing(array, na):
+    """
+    Replace the values of a numeric array where ``na`` is set with ``None``,
+    which requires an array of python objects.
+    """
+    if not na.any():
+        return array
+    array = array.astype(object)
+    array[na] = None
+    return array
+
+
+def _to_array(vector):
+    """
+    Convert an R vector to a one-dimensional NumPy array, as stored in the
+    ``columns`` format. Factors and any other non-numeric vectors, as well as
+    numeric vectors containing NA, become arrays of python objects, with
+    ``None`` for missing values.
+    """
+    if not isinstance(vector, rpy2.robjects.vectors.FactorVector):
+        if vector.typeof == rpy2.rinterface.REALSXP:
+            # NA is stored as a NaN, but unlike NaN it is a missing value
+            na = numpy.array(rpy2.robjects.r['is.na'](vector), dtype=bool)
+            na &= ~numpy.array(rpy2.robjects.r['is.nan'](vector), dtype=bool)
+            return _with_missing(numpy.array(vector, dtype=numpy.float64), na)
+
+        if vector.typeof == rpy2.rinterface.INTSXP:
+            array = numpy.array(vector, dtype=numpy.int64)
+            return _with_missing(array, array == _NA_INTEGER)
+
+    strings = rpy2.robjects.r['as.character'](vector)
+    array = numpy.empty(len(strings), dtype=object)
+    array[:] = [None if v is rpy2.rinterface.NA_Character else v
+                for v in strings]
+    return array
+
+
+def columns_to_dataframe(input):
+    """
+    Convert a table in ``columns`` format to an R data frame, without
+    formatting it as CSV text and parsing it again in R.
+
+    :param input: The table, as a dict of ``fields`` and ``columns``.
+    :type input: dict
+    """
+    with _lock:
+        items = [(str(field), _to_vector(input['columns'][field]))
+                 for field in input['fields']]
+        items.append(('check.names', rpy2.robjects.BoolVector([False])))
+
+        df = rpy2.robjects.baseenv['data.frame'].rcall(
+            tuple(items), rpy2.robjects.globalenv)
+        return rpy2.robjects.r(_finish_dataframe)(df)
+
+
+def dataframe_to_columns(df):
+    """
+    Convert an R data frame to a table in ``columns`` format. Row names are
+    dropped, as when writing the data frame as CSV.
+
+    :param df: The R data frame.
+    """
+    with _lock:
+        fields = list(df.names)
+        return {
+            'fields': fields,
+            'columns': {field: _to_array(df[i])
+                        for i, field in enumerate(fields)}
+        }
@@ -1,18 +1,48 @@
 import rpy2.robjects
+import threading
+
+from girder_worker import config
+
+# The embedded R interpreter is not thread-safe, and tasks share its search
+# path, so only one R task may run at a time, e.g. when workflow steps are run
+# concurrently.
+_lock = threading.Lock()
+
+
+def _detach_packages():
+    """
+    Whether to detach the packages attached by earlier tasks before a task. By
+    default packages stay attached, so that later tasks in the same worker
+    process need not load them again.
+    """
+    if config.has_option('r', 'detach_packages'):
+        return config.getboolean('r', 'detach_packages')
+    return False
 
 
 def run(task, inputs, outputs, task_inputs, task_outputs, **kwargs):
-    env = rpy2.robjects.globalenv
+    with _lock:
+        _run(task, inputs, outputs, task_inputs, task_outputs, **kwargs)
 
-    # Clear out workspace variables and packages
+
+def _run(task, inputs, outputs, task_inputs, task_outputs, **kwargs):
+    # Clear out workspace variables, and packages if configured to do so
     rpy2.robjects.reval("""
         rm(list = ls())
-        pkgs <- names(sessionInfo()$otherPkgs)
-        if (!is.null(pkgs)) {
-            pkgs <- paste('package:', pkgs, sep = '')
-            lapply(pkgs, detach, character.only = TRUE, unload = TRUE)
-        }
-        """, env)
+        """, rpy2.robjects.globalenv)
+
+    if _detach_packages():
+        rpy2.robjects.reval("""
+            pkgs <- names(sessionInfo()$otherPkgs)
+            if (!is.null(pkgs)) {
+                pkgs <- paste('package:', pkgs, sep = '')
+                lapply(pkgs, detach, character.only = TRUE, unload = TRUE)
+            }
+            """, rpy2.robjects.globalenv)
+
+    # Each task runs in a new environment, so that its variables are isolated
+    # from those of other tasks, while it still sees the attached packages.
+    env = rpy2.robjects.r['new.env'](parent=rpy2.robjects.globalenv)
 
     env['tempdir'] = kwargs.get('_tempdir')
 
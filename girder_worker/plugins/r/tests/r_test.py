@@ -1,4 +1,6 @@
 import girder_worker
+import numpy
+import rpy2.robjects
 import unittest
 
 
@@ -59,5 +61,73 @@ class TestR(unittest.TestCase):
             self.function_in, inputs={'input': outputs['output']})
         self.assertEqual(outputs['output']['data'], 16)
 
+    def test_isolated_environment(self):
+        task = {
+            'inputs': [],
+            'outputs': [
+                {'name': 'output', 'type': 'number', 'format': 'number'}],
+            'script': 'output = as.numeric(exists("x"))\nx = 1',
+            'mode': 'r'
+        }
+
+        # Variables set by a task must not be visible to later tasks
+        for _ in range(2):
+            outputs = girder_worker.run(task, inputs={})
+            self.assertEqual(outputs['output']['data'], 0)
+
+    def test_columns_dataframe(self):
+        names = numpy.empty(3, dtype=object)
+        names[:] = ['a', 'b', None]
+        missing = numpy.empty(3, dtype=object)
+        missing[:] = [1.5, '', None]
+        columns = {
+            'fields': ['name', 'count', 'value', 'missing'],
+            'columns': {
+                'name': names,
+                'count': numpy.array([1, 2, 3]),
+                'value': numpy.array([0.5, 1.5, 2.5]),
+                'missing': missing
+            }
+        }
+
+        df = girder_worker.convert(
+            'table', {'format': 'columns', 'data': columns},
+            {'format': 'r.dataframe'})['data']
+        self.assertEqual(list(df.names), ['name', 'count', 'value', 'missing'])
+
+        output = girder_worker.convert(
+            'table', {'format': 'r.dataframe', 'data': df},
+            {'format': 'columns'})['data']
+        self.assertEqual(output['fields'],
+                         ['name', 'count', 'value', 'missing'])
+        self.assertEqual(output['columns']['name'].tolist(), ['a', 'b', None])
+        self.assertEqual(output['columns']['count'].dtype, numpy.int64)
+        self.assertEqual(output['columns']['count'].tolist(), [1, 2, 3])
+        self.assertEqual(output['columns']['value'].tolist(), [0.5, 1.5, 2.5])
+
+        # Empty cells are NA, as with read.csv, and NA is returned as None
+        self.assertEqual(output['columns']['missing'].tolist(),
+                         [1.5, None, None])
+
+    def test_rows_dataframe(self):
+        rows = {
+            'fields': ['name', 'count', 'text', 'flag'],
+            'rows': [
+                {'name': 'a', 'count': 1, 'text': '1.5', 'flag': True},
+                {'name': 'b', 'count': 2, 'text': '', 'flag': False}
+            ]
+        }
+
+        # Rows are converted through columns rather than CSV text, but give
+        # the same data frame as read.csv
+        direct = girder_worker.convert(
+            'table', {'format': 'rows', 'data': rows},
+            {'format': 'r.dataframe'})['data']
+        csv = girder_worker.convert(
+            'table', {'format': 'rows', 'data': rows}, {'format': 'csv'})
+        via_csv = girder_worker.convert(
+            'table', csv, {'format': 'r.dataframe'})['data']
+        self.assertTrue(rpy2.robjects.r['identical'](direct, via_csv)[0])
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,4 +1,5 @@
 import os
+import uuid
 import girder_worker
 from . import pyspark_executor, spark
 
@@ -8,18 +9,32 @@ SC_KEY = '_girder_worker_spark_context'
 def setup_pyspark_task(event):
     """
     This is executed before a task execution. If it is a pyspark task, we
-    create the spark context here so it can be used for any input conversion.
+    get the spark context here so it can be used for any input conversion. The
+    Spark jobs of the task are run in their own job group, so that they can be
+    told apart from those of other tasks sharing the context, and cancelled.
     """
     info = event.info
     if info['mode'] == 'spark.python' and SC_KEY not in info['kwargs']:
         spark_conf = info['task'].get('spark_conf', {})
-        info['kwargs'][SC_KEY] = spark.create_spark_context(spark_conf)
+        sc = spark.acquire_spark_context(spark_conf)
+        info['kwargs'][SC_KEY] = sc
         info['cleanup_spark'] = True
 
+        info['spark_job_group'] = uuid.uuid4().hex
+        sc.setJobGroup(info['spark_job_group'],
+                       info['task'].get('name', 'girder_worker task'),
+                       interruptOnCancel=True)
+
 
 def pyspark_run_cleanup(event):
     if event.info.get('cleanup_spark'):
-        event.info['kwargs'][SC_KEY].stop()
+        sc = event.info['kwargs'][SC_KEY]
+        try:
+            # Stop any jobs that the task left running, e.g. if it failed
+            if sc._jsc is not None:
+                sc.cancelJobGroup(event.info['spark_job_group'])
+        finally:
+            spark.release_spark_context(sc)
 
 
 def load(params):
@@ -0,0 +1,69 @@
+# flake8: noqa
+import csv
+from pyspark.sql.types import (
+    DoubleType, LongType, StringType, StructField, StructType)
+from girder_worker.plugins.spark.dataframe import sql_context, to_uri
+
+# The functions below are run by the Spark executors, so they are defined in
+# the script to be shipped along with the job.
+
+UNKNOWN, INT, FLOAT, STRING = -1, 0, 1, 2
+
+
+def to_bytes(line):
+    return line.encode('utf8') if isinstance(line, unicode) else line
+
+
+def parse_row(row, size):
+    row = [value.decode('utf8') for value in row[:size]]
+    return row + [u''] * (size - len(row))
+
+
+def parse(index, lines, size):
+    rows = csv.reader(to_bytes(line) for line in lines)
+    if index == 0:
+        next(rows, None)  # The header
+    for row in rows:
+        yield parse_row(row, size)
+
+
+def kind(value):
+    for k, number in ((INT, int), (FLOAT, float)):
+        try:
+            number(value)
+            return k
+        except ValueError:
+            pass
+    return STRING
+
+
+def merge_kinds(kinds, row):
+    return [max(k, kind(v)) if v else k for k, v in zip(kinds, row)]
+
+
+def convert(row, kinds):
+    return [
+        v if k == STRING else None if v == '' else int(v) if k == INT
+        else float(v) for k, v in zip(kinds, row)]
+
+
+# The input is fetched to a file, whose lines are read in partitions by the
+# executors
+lines = sc.textFile(to_uri(input))
+fields = [v.decode('utf8') for v in next(csv.reader([to_bytes(lines.first())]))]
+size = len(fields)
+rows = lines.mapPartitionsWithIndex(
+    lambda index, lines: parse(index, lines, size))
+
+# Columns whose values are all integers or all numbers are converted, as for
+# CSV tables read by the worker itself.
+kinds = rows.aggregate(
+    [UNKNOWN] * size, merge_kinds, lambda a, b: map(max, a, b))
+kinds = [STRING if k == UNKNOWN else k for k in kinds]
+
+types = {INT: LongType(), FLOAT: DoubleType(), STRING: StringType()}
+schema = StructType([
+    StructField(field, types[k], True) for field, k in zip(fields, kinds)])
+
+output = sql_context(sc).createDataFrame(
+    rows.map(lambda row: convert(row, kinds)), schema)
@@ -0,0 +1,4 @@
+# flake8: noqa
+from girder_worker.plugins.spark.dataframe import sql_context, to_uri
+
+output = sql_context(sc).read.parquet(to_uri(input))
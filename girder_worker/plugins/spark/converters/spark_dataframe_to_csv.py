@@ -0,0 +1,17 @@
+# flake8: noqa
+import csv
+import six
+from girder_worker.plugins.spark.dataframe import write_lines
+
+# Run by the Spark executors, so it is defined in the script to be shipped
+# along with the job.
+def format_row(row):
+    buf = six.StringIO()
+    csv.writer(buf, lineterminator='').writerow([
+        '' if v is None else
+        v.encode('utf8') if isinstance(v, unicode) else v for v in row])
+    return buf.getvalue()
+
+
+output = write_lines(
+    input.rdd.map(format_row), _tempdir, header=format_row(input.columns))
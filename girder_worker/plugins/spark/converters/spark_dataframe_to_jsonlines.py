@@ -0,0 +1,4 @@
+# flake8: noqa
+from girder_worker.plugins.spark.dataframe import write_lines
+
+output = write_lines(input.toJSON(), _tempdir)
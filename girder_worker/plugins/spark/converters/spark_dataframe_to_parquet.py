@@ -0,0 +1,4 @@
+# flake8: noqa
+from girder_worker.plugins.spark.dataframe import write_parquet
+
+output = write_parquet(input, _tempdir)
@@ -0,0 +1,87 @@
+import glob
+import os
+import shutil
+import tempfile
+
+
+def sql_context(sc):
+    from pyspark.sql import SQLContext
+
+    return SQLContext(sc)
+
+
+def to_uri(path):
+    """
+    Spark resolves paths without a scheme against its default file system,
+    which need not be the local one.
+    """
+    return 'file://' + os.path.abspath(path)
+
+
+def _part_files(path, suffix=''):
+    """
+    List the partitions written by Spark to the given directory. If there are
+    none, the executors wrote them to a file system the worker cannot read.
+    """
+    parts = sorted(glob.glob(os.path.join(path, 'part-*' + suffix)))
+    if not parts:
+        raise Exception(
+            'No partitions of the Spark output were found in %s. The '
+            'worker\'s tmp_root must be on a file system shared with the '
+            'Spark executors.' % path)
+    return parts
+
+
+def _assemble(parts, tempdir, header=None):
+    """
+    Concatenate partitions into a single file in the given temp dir, without
+    reading them into memory.
+
+    :returns: The path of the file.
+    """
+    fd, path = tempfile.mkstemp(dir=tempdir)
+    with os.fdopen(fd, 'wb') as out:
+        if header is not None:
+            out.write(header + '\n')
+        for part in parts:
+            with open(part, 'rb') as f:
+                shutil.copyfileobj(f, out)
+    return path
+
+
+def write_lines(rdd, tempdir, header=None):
+    """
+    Write an RDD of lines of text in partitions, and assemble the partitions
+    into a single file.
+
+    :param rdd: The RDD of lines.
+    :param tempdir: The temp dir to write the partitions to. It must be
+        accessible to the Spark executors.
+    :param header: An optional first line.
+    :returns: The path of the file.
+    """
+    path = os.path.join(tempfile.mkdtemp(dir=tempdir), 'parts')
+    try:
+        rdd.saveAsTextFile(to_uri(path))
+        return _assemble(_part_files(path), tempdir, header)
+    finally:
+        shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+
+
+def write_parquet(df, tempdir):
+    """
+    Write a Spark DataFrame as a single Parquet file.
+
+    :returns: The path of the file.
+    """
+    path = os.path.join(tempfile.mkdtemp(dir=tempdir), 'parts')
+    try:
+        df.coalesce(1).write.parquet(to_uri(path))
+
+        part, = _part_files(path, '.parquet')
+        fd, dst = tempfile.mkstemp(dir=tempdir)
+        os.close(fd)
+        shutil.move(part, dst)
+        return dst
+    finally:
+        shutil.rmtree(os.path.dirname(path), ignore_errors=True)
@@ -2,6 +2,8 @@ import imp
 import json
 import sys
 
+from girder_worker.executors.python import code_cache
+
 
 def run(task, inputs, outputs, task_inputs, task_outputs, **kwargs):
     from . import SC_KEY
@@ -28,7 +30,7 @@ def run(task, inputs, outputs, task_inputs, task_outputs, **kwargs):
 
     else:
         try:
-            exec task['script'] in custom.__dict__
+            exec code_cache.compile(task['script']) in custom.__dict__
         except Exception, e:
             trace = sys.exc_info()[2]
             lines = task['script'].split('\n')
@@ -1,6 +1,7 @@
 import girder_worker
 import os
 import sys
+import threading
 
 from ConfigParser import NoOptionError, NoSectionError
 
@@ -35,20 +36,113 @@ def setup_spark_env():
     from pyspark import SparkConf, SparkContext  # noqa
 
 
-def create_spark_context(task_spark_conf):
-    from pyspark import SparkConf, SparkContext
-    # Set can spark configuration parameter user has specified
-    spark_conf = SparkConf()
+# The SparkContext shared by tasks when reuse_context is enabled, the
+# configuration it was created with and the number of tasks using it
+_context = None
+_context_conf = None
+_context_users = 0
+_context_cond = threading.Condition()
+
+# Options of the spark config section that are not Spark properties
+_WORKER_OPTIONS = ('reuse_context',)
+
+# Spark properties that may differ between tasks sharing a context
+_TASK_PROPERTIES = ('spark.app.name',)
+
+
+def _reuse_context():
+    if girder_worker.config.has_option('spark', 'reuse_context'):
+        return girder_worker.config.getboolean('spark', 'reuse_context')
+    return False
+
+
+def _spark_conf(task_spark_conf):
+    conf = {}
 
     if girder_worker.config.has_section('spark'):
         for (name, value) in girder_worker.config.items('spark'):
-            spark_conf.set(name, value)
+            if name not in _WORKER_OPTIONS:
+                conf[name] = value
 
     # Override with any task specific configuration
-    for (name, value) in task_spark_conf.items():
+    conf.update(task_spark_conf)
+
+    return conf
+
+
+def _is_compatible(conf, other):
+    def strip(conf):
+        return {name: value for name, value in conf.items()
+                if name not in _TASK_PROPERTIES}
+
+    return strip(conf) == strip(other)
+
+
+def create_spark_context(task_spark_conf):
+    from pyspark import SparkConf, SparkContext
+    # Set can spark configuration parameter user has specified
+    spark_conf = SparkConf()
+
+    for (name, value) in _spark_conf(task_spark_conf).items():
         spark_conf.set(name, value)
 
     # Build up the context, using the master URL
     sc = SparkContext(conf=spark_conf)
 
     return sc
+
+
+def acquire_spark_context(task_spark_conf):
+    """
+    Get a SparkContext for a task. If the ``reuse_context`` option of the
+    ``spark`` config section is set, a single context is shared by all tasks
+    run by the worker, and is only recreated when a task's ``spark_conf`` is
+    incompatible with it, i.e. differs in anything but the application name.
+    In that case this waits for the tasks using the current context to finish.
+    Otherwise a new context is created for each task.
+
+    Each context must be released with :py:func:`release_spark_context` once
+    the task is done.
+
+    :param task_spark_conf: The Spark properties specified by the task.
+    :type task_spark_conf: dict
+    """
+    global _context, _context_conf, _context_users
+
+    if not _reuse_context():
+        return create_spark_context(task_spark_conf)
+
+    conf = _spark_conf(task_spark_conf)
+    with _context_cond:
+        while _context_users and not _is_compatible(conf, _context_conf):
+            _context_cond.wait()
+
+        # A task may have stopped the shared context itself
+        if _context is not None and (
+                _context._jsc is None or
+                not _is_compatible(conf, _context_conf)):
+            _context.stop()
+            _context = None
+
+        if _context is None:
+            _context = create_spark_context(task_spark_conf)
+            _context_conf = conf
+
+        _context_users += 1
+        return _context
+
+
+def release_spark_context(sc):
+    """
+    Release a SparkContext returned by :py:func:`acquire_spark_context`. The
+    shared context is kept running for later tasks; any other is stopped.
+    """
+    global _context_users
+
+    with _context_cond:
+        if sc is not _context:
+            sc.stop()
+            return
+
+        _context_users -= 1
+        _context_cond.notify_all()
@@ -1,6 +1,10 @@
 import girder_worker
 import unittest
 import os
+import shutil
+import tempfile
+
+from girder_worker.plugins.spark import dataframe, spark
 
 
 class TestSpark(unittest.TestCase):
@@ -76,5 +80,82 @@ class TestSpark(unittest.TestCase):
         }
         self.assertEqual(outputs, expected)
 
+    def testCsvToSparkDataFrame(self):
+        analysis = {
+            'name': 'filter',
+            'inputs': [
+                {'name': 'a', 'type': 'table', 'format': 'spark.dataframe'}
+            ],
+            'outputs': [
+                {'name': 'b', 'type': 'table', 'format': 'spark.dataframe'}
+            ],
+            'mode': 'spark.python',
+            'script': 'b = a.filter(a.x > 1)',
+            'spark_conf': {
+                'spark.app.name': 'test_filter',
+                'spark.master': os.environ['SPARK_TEST_MASTER_URL']
+            }
+        }
+
+        outputs = girder_worker.run(
+            analysis,
+            {'a': {'format': 'csv', 'data': 'x,y\n1,a\n2,b\n3.5,c\n'}},
+            {'b': {'format': 'csv'}})
+        self.assertEqual(outputs['b']['data'], 'x,y\n2.0,b\n3.5,c\n')
+
+    def testWriteLines(self):
+        class Rdd(object):
+            def __init__(self, files):
+                self.files = files
+
+            def saveAsTextFile(self, uri):
+                path = uri[len('file://'):]
+                os.mkdir(path)
+                for name, data in self.files.items():
+                    with open(os.path.join(path, name), 'w') as f:
+                        f.write(data)
+
+        tempdir = tempfile.mkdtemp()
+        try:
+            path = dataframe.write_lines(Rdd({
+                'part-00001': 'c\n', 'part-00000': 'b\n', '_SUCCESS': ''
+            }), tempdir, header='a')
+            with open(path) as f:
+                self.assertEqual(f.read(), 'a\nb\nc\n')
+
+            # Partitions written to the executors' own file systems are not
+            # silently dropped
+            with self.assertRaises(Exception):
+                dataframe.write_lines(Rdd({'_SUCCESS': ''}), tempdir)
+        finally:
+            shutil.rmtree(tempdir)
+
+    def testReuseContext(self):
+        analysis = {
+            'name': 'context',
+            'inputs': [],
+            'outputs': [{'name': 'b', 'type': 'number', 'format': 'number'}],
+            'mode': 'spark.python',
+            'script': 'b = id(sc)',
+            'spark_conf': {
+                'spark.master': os.environ['SPARK_TEST_MASTER_URL']
+            }
+        }
+
+        if not girder_worker.config.has_section('spark'):
+            girder_worker.config.add_section('spark')
+        girder_worker.config.set('spark', 'reuse_context', 'true')
+        try:
+            ids = set()
+            for name in ('test_first', 'test_second'):
+                analysis['spark_conf']['spark.app.name'] = name
+                outputs = girder_worker.run(analysis, {})
+                ids.add(outputs['b']['data'])
+            self.assertEqual(len(ids), 1)
+        finally:
+            girder_worker.config.remove_option('spark', 'reuse_context')
+            spark._context.stop()
+            spark._context = None
+
     def tearDown(self):
         os.chdir(self.prevdir)
@@ -1,5 +1,6 @@
 import contextlib
 import errno
+import fcntl
 import functools
 import imp
 import os
@@ -13,8 +14,12 @@ import subprocess
 import stat
 import sys
 import tempfile
+import threading
 import time
 import traceback
+import uuid
+
+from requests.packages.urllib3.util.retry import Retry
 
 
 class JobStatus(object):
@@ -62,12 +67,65 @@ class TerminalColor(object):
         return TerminalColor._color(TerminalColor.INFO, text)
 
 
+_http_session = None
+_http_session_pid = None
+_http_session_lock = threading.Lock()
+
+
+def http_session():
+    """
+    Return the ``requests.Session`` shared by the HTTP requests of the worker,
+    i.e. those of the ``http`` IO mode and the job updates sent by
+    :py:class:`JobManager`, so that connections to each host are kept alive and
+    reused rather than opened for every request. The size of its connection
+    pools and its retry policy are set by the ``http_pool_connections``,
+    ``http_pool_maxsize``, ``http_retries`` and ``http_retry_backoff`` config
+    options. Each process has its own session, since connections cannot be
+    shared with forked processes.
+    """
+    global _http_session, _http_session_pid
+
+    with _http_session_lock:
+        if _http_session is None or _http_session_pid != os.getpid():
+            _http_session = _new_http_session()
+            _http_session_pid = os.getpid()
+        return _http_session
+
+
+def _new_http_session():
+    config = girder_worker.config
+    section = 'girder_worker'
+    retries = Retry(
+        total=config.getint(section, 'http_retries'),
+        backoff_factor=config.getfloat(section, 'http_retry_backoff'),
+        status_forcelist=(502, 503, 504),
+        # Failed connections are retried for all requests, but once the
+        # request may have been sent, only those without a body are resent.
+        method_whitelist=frozenset(['HEAD', 'GET', 'OPTIONS']),
+        raise_on_status=False)
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=config.getint(section, 'http_pool_connections'),
+        pool_maxsize=config.getint(section, 'http_pool_maxsize'),
+        max_retries=retries)
+
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    # The session is shared by unrelated jobs, so it must not keep cookies
+    session.cookies.set_policy(six.moves.http_cookiejar.DefaultCookiePolicy(
+        allowed_domains=[]))
+    return session
+
+
 class JobManager(object):
     """
     This class is a context manager that can be used to write log messages to
     Girder by capturing stdout/stderr printed within the context and sending
-    them in a rate-limited manner to Girder. This is not threadsafe since it
-    changes the global values of sys.stdout/sys.stderr.
+    them in a rate-limited manner to Girder. It changes the global values of
+    sys.stdout/sys.stderr, so output printed by any thread, e.g. by concurrent
+    fetches or workflow steps, is captured. Updates are serialized, and the
+    output of each thread is added to the log a line at a time, so that lines
+    printed by different threads are not mixed up.
 
     It also exposes utilities for updating other job fields such as progress
     and status.
@@ -95,6 +153,10 @@ class JobManager(object):
 
         self._last = time.time()
         self._buf = ''
+        self._lines = {}  # Incomplete lines printed by each thread
+        self._lock = threading.RLock()
+        self._local = threading.local()
+        self._sending = False
         self._progressTotal = None
         self._progressCurrent = None
         self._progressMessage = None
@@ -122,7 +184,10 @@ class JobManager(object):
         else:
             self.updateStatus(JobStatus.SUCCESS)
 
-        self._flush()
+        with self._lock:
+            self._buf += ''.join(self._lines.values())
+            self._lines.clear()
+            self._flush()
         self._redirectPipes(False)
 
     def _redirectPipes(self, redirect):
@@ -132,6 +197,20 @@ class JobManager(object):
             else:
                 sys.stdout, sys.stderr = self._pipes
 
+    def _request(self, data):
+        """
+        Send an update of the job to the server. Output printed while the
+        request is made, e.g. warnings, is not added to the log, since the log
+        may be being sent.
+        """
+        self._sending = True
+        try:
+            http_session().request(
+                self.method.upper(), self.url, allow_redirects=True,
+                headers=self.headers, data=data)
+        finally:
+            self._sending = False
+
     def _flush(self):
         """
         If there are contents in the buffer, send them up to the server. If the
@@ -140,28 +219,24 @@ class JobManager(object):
         if not self.url:
             return
 
-        if len(self._buf) or self._progressTotal or self._progressMessage or \
-                self._progressCurrent is not None:
-            self._redirectPipes(False)
-
-            requests.request(
-                self.method.upper(), self.url, allow_redirects=True,
-                headers=self.headers, data={
+        with self._lock:
+            if len(self._buf) or self._progressTotal or \
+                    self._progressMessage or self._progressCurrent is not None:
+                self._request({
                     'log': self._buf,
                     'progressTotal': self._progressTotal,
                     'progressCurrent': self._progressCurrent,
                     'progressMessage': self._progressMessage
                 })
-            self._buf = ''
-
-            self._redirectPipes(True)
+                self._buf = ''
 
     def write(self, message, forceFlush=False):
         """
         Append a message to the log for this job. If logPrint is enabled, this
         will be called whenever stdout or stderr is printed to. Otherwise it
         can be called manually and will still perform rate-limited flushing to
-        the server.
+        the server. Messages are added to the log once the line they belong to
+        is complete, or when the job manager exits.
 
         :param message: The message to append to the job log.
         :type message: str
@@ -175,10 +250,30 @@ class JobManager(object):
         if type(message) == unicode:
             message = message.encode('utf8')
 
-        self._buf += message
-        if forceFlush or time.time() - self._last > self.interval:
-            self._flush()
-            self._last = time.time()
+        with self._lock:
+            if self._sending:
+                return
+
+            thread = threading.current_thread().ident
+            line = self._lines.pop(thread, '') + message
+            end = line.rfind('\n') + 1
+            self._buf += line[:end]
+            if line[end:]:
+                self._lines[thread] = line[end:]
+
+            if forceFlush or time.time() - self._last > self.interval:
+                self._flush()
+                self._last = time.time()
+
+    @property
+    def softspace(self):
+        # Kept by print statements, per thread, since they print to the job
+        # manager concurrently.
+        return getattr(self._local, 'softspace', 0)
+
+    @softspace.setter
+    def softspace(self, value):
+        self._local.softspace = value
 
     def updateStatus(self, status):
         """
@@ -187,14 +282,12 @@ class JobManager(object):
         :param status: The status to set on the job.
         :type status: JobStatus
         """
-        if not self.url or status is None or status == self.status:
-            return
+        with self._lock:
+            if not self.url or status is None or status == self.status:
+                return
 
-        self.status = status
-        self._redirectPipes(False)
-        requests.request(self.method.upper(), self.url, headers=self.headers,
-                         data={'status': status}, allow_redirects=True)
-        self._redirectPipes(True)
+            self.status = status
+            self._request({'status': status})
 
     def updateProgress(self, total=None, current=None, message=None,
                        forceFlush=False):
@@ -211,16 +304,17 @@ class JobManager(object):
             server. Useful if you don't expect another update for some time.
         :type forceFlush: bool
         """
-        if total is not None:
-            self._progressTotal = total
-        if current is not None:
-            self._progressCurrent = current
-        if message is not None:
-            self._progressMessage = message
+        with self._lock:
+            if total is not None:
+                self._progressTotal = total
+            if current is not None:
+                self._progressCurrent = current
+            if message is not None:
+                self._progressMessage = message
 
-        if forceFlush or time.time() - self._last > self.interval:
-            self._flush()
-            self._last = time.time()
+            if forceFlush or time.time() - self._last > self.interval:
+                self._flush()
+                self._last = time.time()
 
 
 def toposort(data):
@@ -261,17 +355,35 @@ def toposort(data):
                         repr(x) for x in data.iteritems()))
 
 
+def _makedirs(path, mode=0o777):
+    try:
+        os.makedirs(path, mode)
+    except OSError:
+        if not os.path.isdir(path):
+            raise
+
+
 @contextlib.contextmanager
-def tmpdir(cleanup=True):
+def tmpdir(cleanup=True, lazy=False):
+    """
+    Context manager yielding the path to a new temp dir underneath the
+    ``tmp_root`` config setting.
+
+    :param cleanup: Whether to delete the temp dir when the context exits.
+    :type cleanup: bool
+    :param lazy: If ``True``, only a unique path is chosen, and the directory
+        is not created until :py:func:`ensure_tmpdir` is called on it.
+    :type lazy: bool
+    """
     # Make the temp dir underneath tmp_root config setting
     root = os.path.abspath(girder_worker.config.get(
         'girder_worker', 'tmp_root'))
-    try:
-        os.makedirs(root)
-    except OSError:
-        if not os.path.isdir(root):
-            raise
-    path = tempfile.mkdtemp(dir=root)
+
+    if lazy:
+        path = os.path.join(root, 'tmp' + uuid.uuid4().hex)
+    else:
+        _makedirs(root)
+        path = tempfile.mkdtemp(dir=root)
 
     try:
         yield path
@@ -281,20 +393,48 @@ def tmpdir(cleanup=True):
             shutil.rmtree(path)
 
 
+def ensure_tmpdir(path):
+    """
+    Create a temp dir that was lazily allocated by :py:func:`tmpdir` or
+    :py:func:`with_tmpdir`, if it does not already exist, along with the temp
+    dirs of the enclosing runs that it is nested in.
+
+    :param path: The path of the temp dir.
+    :type path: str
+    """
+    root = os.path.abspath(girder_worker.config.get(
+        'girder_worker', 'tmp_root'))
+
+    missing = []
+    while path != root and not os.path.isdir(path):
+        missing.append(path)
+        path = os.path.dirname(path)
+    _makedirs(path)
+
+    for path in reversed(missing):
+        try:
+            os.mkdir(path, 0o700)  # Same mode as tempfile.mkdtemp
+        except OSError:
+            if not os.path.isdir(path):
+                raise
+
+
 def with_tmpdir(fn):
     """
     This function is provided as a convenience to allow use as a decorator of
     a function rather than using "with tmpdir()" around the whole function
     body. It passes the generated temp dir path into the function as the
-    special kwarg "_tempdir".
+    special kwarg "_tempdir". The temp dir is allocated lazily, so callers must
+    call :py:func:`ensure_tmpdir` before using it. If a "_tempdir" is already
+    passed, e.g. by an enclosing run of the same job, it is shared instead.
     """
     @functools.wraps(fn)
     def wrapped(*args, **kwargs):
-        if '_tempdir' in kwargs:
+        if kwargs.get('_tempdir'):
             return fn(*args, **kwargs)
 
         cleanup = kwargs.get('cleanup', True)
-        with tmpdir(cleanup=cleanup) as tempdir:
+        with tmpdir(cleanup=cleanup, lazy=True) as tempdir:
             kwargs['_tempdir'] = tempdir
             return fn(*args, **kwargs)
     return wrapped
@@ -372,7 +512,18 @@ def load_plugin(name, paths):
                 name, '\n   '.join(paths)))
 
 
-def _close_pipes(rds, wds, input_pipes, output_pipes, stdout, stderr):
+def _close_input(fd, p):
+    """
+    Close an input pipe of the subprocess ``p``. Its stdin must be closed via
+    its file object, which would otherwise fail to close it again later.
+    """
+    if fd == p.stdin.fileno():
+        p.stdin.close()
+    else:
+        os.close(fd)
+
+
+def _close_pipes(rds, wds, input_pipes, output_pipes, stdout, stderr, p):
     """
     Helper to close remaining input and output adapters after the subprocess
     completes.
@@ -387,7 +538,7 @@ def _close_pipes(rds, wds, input_pipes, output_pipes, stdout, stderr):
     # close any remaining input adapters
     for fd in wds:
         if fd in input_pipes:
-            os.close(fd)
+            _close_input(fd, p)
 
 
 def _setup_input_pipes(input_pipes, stdin):
@@ -399,7 +550,7 @@ def _setup_input_pipes(input_pipes, stdin):
     """
     wds = []
     fifos = {}
-    for pipe, adapter in six.viewitems(input_pipes):
+    for pipe, adapter in list(six.viewitems(input_pipes)):
         if isinstance(pipe, int):
             # This is assumed to be an open system-level file descriptor
             wds.append(pipe)
@@ -436,6 +587,248 @@ def _open_ipipes(wds, fifos, input_pipes):
     return wds, fifos, input_pipes
 
 
+def _wait_for_pipes(rds, wds, timeout=None):
+    """
+    Block until some of the given file descriptors are ready for reading or
+    writing, or until the timeout expires. Descriptors that were closed by the
+    other end are reported as ready, so that the caller notices the end of the
+    stream or the error. This uses ``poll`` where it is available, since unlike
+    ``select`` it is not limited in the values of the descriptors.
+
+    :param rds: The descriptors to wait on for reading.
+    :type rds: list of int
+    :param wds: The descriptors to wait on for writing.
+    :type wds: list of int
+    :param timeout: The maximum number of seconds to wait, or ``None`` to wait
+        indefinitely.
+    :type timeout: float
+    :returns: A tuple of the lists of readable and writable descriptors.
+    """
+    if not hasattr(select, 'poll'):
+        readable, writable, _ = select.select(rds, wds, (), timeout)
+        return readable, writable
+
+    poller = select.poll()
+    for fd in rds:
+        poller.register(fd, select.POLLIN | select.POLLPRI)
+    for fd in wds:
+        poller.register(fd, select.POLLOUT)
+
+    ms = None if timeout is None else int(timeout * 1000)
+    events = dict(poller.poll(ms))
+    return ([fd for fd in rds if fd in events],
+            [fd for fd in wds if fd in events])
+
+
+def _set_nonblocking(fd):
+    flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+    fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+
+def _set_cloexec(fd):
+    flags = fcntl.fcntl(fd, fcntl.F_GETFD)
+    fcntl.fcntl(fd, fcntl.F_SETFD, flags | fcntl.FD_CLOEXEC)
+
+
+class _Wakeup(object):
+    """
+    A pipe that other threads write to in order to wake the loop of
+    :py:func:`run_process` while it waits on its pipes.
+    """
+    def __init__(self):
+        self.fd, self._wfd = os.pipe()
+        _set_nonblocking(self.fd)
+        _set_nonblocking(self._wfd)
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def notify(self):
+        with self._lock:
+            if self._closed:
+                return
+            try:
+                os.write(self._wfd, b'x')
+            except OSError as e:
+                # If the pipe is full, the loop will be woken anyway
+                if e.errno != errno.EAGAIN:
+                    raise
+
+    def clear(self):
+        try:
+            os.read(self.fd, 4096)
+        except OSError as e:
+            if e.errno != errno.EAGAIN:
+                raise
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            os.close(self.fd)
+            os.close(self._wfd)
+
+
+class _InputReader(object):
+    """
+    Reads from a ``StreamFetchAdapter`` on a background thread into a bounded
+    buffer of chunks, so that the loop of :py:func:`run_process` only writes
+    data that is already available, and a slow input stream does not hold up
+    the other pipes of the subprocess.
+    """
+    def __init__(self, adapter, buf_len, wakeup, maxsize=16):
+        self._queue = six.moves.queue.Queue(maxsize)
+        self._stopped = threading.Event()
+        self._wakeup = wakeup
+        # Data taken from the buffer that is yet to be written to the pipe
+        self.pending = None
+
+        thread = threading.Thread(target=self._run, args=(adapter, buf_len))
+        thread.daemon = True
+        thread.start()
+
+    def _put(self, item):
+        while not self._stopped.is_set():
+            try:
+                self._queue.put(item, timeout=0.5)
+                self._wakeup.notify()
+                return True
+            except six.moves.queue.Full:
+                pass
+        return False
+
+    def _run(self, adapter, buf_len):
+        try:
+            while True:
+                buf = adapter.read(buf_len)
+                if not self._put(buf) or not buf:
+                    break
+        except Exception:
+            self._put(sys.exc_info())
+
+    def ready(self):
+        """
+        Whether there is data, or the end of the stream, to write to the pipe.
+        """
+        return self.pending is not None or not self._queue.empty()
+
+    def take(self):
+        """
+        Return the data to write to the pipe, which is empty at the end of the
+        stream. Errors raised by the adapter are re-raised here.
+        """
+        if self.pending is None:
+            self.pending = self._queue.get_nowait()
+        if isinstance(self.pending, tuple):
+            e = self.pending
+            raise e[0], e[1], e[2]
+        return self.pending
+
+    def write(self, fd):
+        """
+        Write the available data of the stream to its pipe, which is
+        non-blocking, so only part of the data may be written.
+
+        :returns: Whether the end of the stream was reached.
+        """
+        buf = self.take()
+        if not buf:
+            return True
+
+        try:
+            written = os.write(fd, buf)
+        except OSError as e:
+            if e.errno != errno.EAGAIN:
+                raise
+            written = 0
+
+        self.pending = buf[written:] or None
+        return False
+
+    def stop(self):
+        self._stopped.set()
+
+
+class _InputTransfer(object):
+    """
+    Writes an input stream whose adapter implements ``transfer`` straight into
+    its pipe, e.g. a local file that the kernel can copy without passing the
+    data through python. Such adapters never block on reading, so they do not
+    need a background thread.
+    """
+    def __init__(self, adapter, buf_len):
+        self._adapter = adapter
+        self._buf_len = buf_len
+
+    def ready(self):
+        return True
+
+    def write(self, fd):
+        """
+        Transfer up to a buffer of data into the pipe.
+
+        :returns: Whether the end of the stream was reached.
+        """
+        try:
+            return self._adapter.transfer(fd, self._buf_len) == 0
+        except OSError as e:
+            if e.errno != errno.EAGAIN:
+                raise
+            return False
+
+    def stop(self):
+        pass
+
+
+def _buffer_size(adapter, default):
+    """
+    Return the size of the chunks in which to move the data of a stream, which
+    the binding of the stream may set in its ``buffer_size`` field.
+    """
+    spec = getattr(adapter, 'input_spec', getattr(adapter, 'output_spec', {}))
+    if isinstance(spec, dict) and spec.get('buffer_size'):
+        return int(spec['buffer_size'])
+    return default
+
+
+def _start_input_readers(wds, input_pipes, readers, buf_len, wakeup):
+    """
+    Start reading the input streams of the pipes in ``wds`` that do not have a
+    reader yet, e.g. named pipes that were just opened. The pipes are made
+    non-blocking, so that writing to them never blocks the loop of
+    :py:func:`run_process`.
+    """
+    for fd in wds:
+        if fd not in readers:
+            _set_nonblocking(fd)
+            adapter = input_pipes[fd]
+            size = _buffer_size(adapter, buf_len)
+            if hasattr(adapter, 'transfer'):
+                readers[fd] = _InputTransfer(adapter, size)
+            else:
+                readers[fd] = _InputReader(adapter, size, wakeup)
+
+
+def _read_output(fd, adapter, buf_len):
+    """
+    Move the available data of an output pipe to its adapter, letting adapters
+    that implement ``transfer`` take it straight from the pipe.
+
+    :returns: Whether the end of the stream was reached.
+    """
+    buf_len = _buffer_size(adapter, buf_len)
+    if hasattr(adapter, 'transfer'):
+        try:
+            return adapter.transfer(fd, buf_len) == 0
+        except OSError as e:
+            if e.errno != errno.EAGAIN:
+                raise
+            return False
+
+    buf = os.read(fd, buf_len)
+    if buf:
+        adapter.write(buf)
+    return not buf
+
+
 def run_process(command, output_pipes=None, input_pipes=None):
     """
     Run a subprocess, and listen for its outputs on various pipes.
@@ -461,11 +854,37 @@ def run_process(command, output_pipes=None, input_pipes=None):
         must be opened for reading before they can be opened for writing
     :type input_pipes: dict
     """
-    BUF_LEN = 65536
+    # The default size of the chunks in which to move the data of streams,
+    # which each stream may override in the ``buffer_size`` of its binding
+    BUF_LEN = girder_worker.config.getint(
+        'girder_worker', 'stream_buffer_size')
+    # Interval at which to retry opening named input pipes, which cannot be
+    # waited on until the subprocess opens them for reading
+    FIFO_RETRY_INTERVAL = 0.05
     input_pipes = input_pipes or {}
     output_pipes = output_pipes or {}
+    # Descriptors are not inherited, so that the subprocess does not hold open
+    # the pipes of other streams, e.g. of concurrent workflow steps.
     p = subprocess.Popen(args=command, stdout=subprocess.PIPE,
-                         stderr=subprocess.PIPE, stdin=subprocess.PIPE)
+                         stderr=subprocess.PIPE, stdin=subprocess.PIPE,
+                         close_fds=True)
+
+    # Other threads wake the loop below through this pipe, i.e. the thread
+    # that waits for the subprocess to exit, and the threads that read the
+    # input streams.
+    wakeup = _Wakeup()
+    exited = threading.Event()
+
+    def wait():
+        try:
+            p.wait()
+        finally:
+            exited.set()
+            wakeup.notify()
+
+    waiter = threading.Thread(target=wait)
+    waiter.daemon = True
+    waiter.start()
 
     # we now know subprocess stdout and stderr filenos, so bind the adapters
     stdout = p.stdout.fileno()
@@ -478,49 +897,50 @@ def run_process(command, output_pipes=None, input_pipes=None):
 
     rds = [fd for fd in output_pipes.keys() if isinstance(fd, int)]
     wds, fifos = _setup_input_pipes(input_pipes, stdin)
+    readers = {}
 
     try:
         while True:
-            status = p.poll()
-            # get ready pipes
-            readable, writable, _ = select.select(rds, wds, (), 0)
+            _start_input_readers(wds, input_pipes, readers, BUF_LEN, wakeup)
 
-            for ready_pipe in readable:
-                buf = os.read(ready_pipe, BUF_LEN)
+            # Once the subprocess has exited, only drain the pipes that are
+            # still ready, rather than waiting for them.
+            done = exited.is_set()
+            timeout = 0 if done else FIFO_RETRY_INTERVAL if fifos else None
+
+            # get ready pipes, only waiting on the input pipes that have data
+            readable, writable = _wait_for_pipes(
+                rds if done else rds + [wakeup.fd],
+                [fd for fd in wds if readers[fd].ready()], timeout)
+            if wakeup.fd in readable:
+                readable.remove(wakeup.fd)
+                wakeup.clear()
 
-                if buf:
-                    output_pipes[ready_pipe].write(buf)
-                else:
+            for ready_pipe in readable:
+                if _read_output(ready_pipe, output_pipes[ready_pipe], BUF_LEN):
                     output_pipes[ready_pipe].close()
                     if ready_pipe not in (stdout, stderr):
                         # bad things happen if parent closes stdout or stderr
                         os.close(ready_pipe)
                     rds.remove(ready_pipe)
             for ready_pipe in writable:
-                # TODO for now it's OK for the input reads to block since
-                # input generally happens first, but we should consider how to
-                # support non-blocking stream inputs in the future.
-                buf = input_pipes[ready_pipe].read(BUF_LEN)
-
-                if buf:
-                    os.write(ready_pipe, buf)
-                else:   # end of stream
+                if readers[ready_pipe].write(ready_pipe):
+                    # end of stream
                     wds.remove(ready_pipe)
-                    os.close(ready_pipe)
+                    _close_input(ready_pipe, p)
 
             wds, fifos, input_pipes = _open_ipipes(wds, fifos, input_pipes)
-            empty = (not rds or not readable) and (not wds or not writable)
-            if empty and status is not None:
+            if done and not readable and not writable:
                 # all pipes are empty and the process has returned, we are done
                 break
-            elif not rds and not wds and status is None:
-                # all pipes are closed but the process is still running
-                p.wait()
     except Exception:
         p.kill()  # kill child process if something went wrong on our end
         raise
     finally:
-        _close_pipes(rds, wds, input_pipes, output_pipes, stdout, stderr)
+        for reader in readers.values():
+            reader.stop()
+        wakeup.close()
+        _close_pipes(rds, wds, input_pipes, output_pipes, stdout, stderr, p)
 
     return p
 
@@ -536,9 +956,17 @@ class StreamFetchAdapter(object):
     def read(self, buf_len):
         """
         Fetch adapters must implement this method, which is responsible for
-        reading up to ``self.buf_len`` bytes from the stream. For now, this is
+        reading up to ``self.buf_len`` bytes from the stream. This is
         expected to be a blocking read, and should return an empty string to
-        indicate the end of the stream.
+        indicate the end of the stream. :py:func:`run_process` calls it from
+        a background thread, so that a slow stream does not hold up the other
+        pipes of the subprocess.
+
+        Adapters may also implement ``transfer(fd, buf_len)``, which writes up
+        to ``buf_len`` bytes of the stream directly to the non-blocking pipe
+        ``fd`` and returns the number of bytes written, or 0 at the end of the
+        stream. :py:func:`run_process` then uses it instead of ``read``,
+        without a background thread.
         """
         raise NotImplemented
 
@@ -571,6 +999,11 @@ class StreamPushAdapter(object):
     def write(self, buf):
         """
         Write a chunk of data to the output stream.
+
+        Adapters may also implement ``transfer(fd, buf_len)``, which moves up
+        to ``buf_len`` bytes from the readable pipe ``fd`` directly into the
+        stream and returns the number of bytes moved, or 0 at the end of the
+        stream. :py:func:`run_process` then uses it instead of ``write``.
         """
         raise NotImplemented
 
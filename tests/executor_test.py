@@ -0,0 +1,41 @@
+import girder_worker
+import unittest
+
+from girder_worker.executors.python import CodeCache
+
+
+class TestPythonExecutor(unittest.TestCase):
+    def test_code_cache(self):
+        cache = CodeCache(maxsize=2)
+
+        code = cache.compile('a = 1')
+        self.assertIs(cache.compile('a = 1'), code)
+        cache.compile(u'b = 2')
+        self.assertEqual(cache.stats(), {
+            'hits': 1, 'misses': 2, 'evictions': 0, 'size': 2, 'maxsize': 2})
+
+        # The least recently used script is evicted first
+        cache.compile('a = 1')
+        cache.compile('c = 3')
+        self.assertEqual(cache.stats()['evictions'], 1)
+        self.assertIs(cache.compile('a = 1'), code)
+
+        cache.resize(1)
+        self.assertEqual(cache.stats()['size'], 1)
+        self.assertEqual(cache.stats()['evictions'], 2)
+
+    def test_shared_code_cache(self):
+        task = {
+            'inputs': [{'name': 'a', 'type': 'number', 'format': 'number'}],
+            'outputs': [{'name': 'b', 'type': 'number', 'format': 'number'}],
+            'script': 'b = a * 3',
+            'mode': 'python'
+        }
+        inputs = {'a': {'format': 'number', 'data': 2}}
+
+        girder_worker.run(task, inputs)
+        hits = girder_worker.code_cache.stats()['hits']
+        outputs = girder_worker.run(task, inputs)
+
+        self.assertEqual(outputs['b']['data'], 6)
+        self.assertGreater(girder_worker.code_cache.stats()['hits'], hits)
@@ -1,8 +1,16 @@
+import contextlib
+import json
+import mock
+import os
 import sys
 import unittest
 import girder_worker
 from girder_worker.format import conv_graph, converter_path, has_converter, \
-    Validator, print_conversion_graph, print_conversion_table
+    Validator, print_conversion_graph, print_conversion_table, \
+    get_route_table_stats, get_validator_function, \
+    register_validator_function, direct_converters, import_converters, \
+    build_route_table, _compile_validator
+from girder_worker.executors.python import code_cache
 from six import StringIO
 from networkx import NetworkXNoPath
 
@@ -35,6 +43,215 @@ class TestFormat(unittest.TestCase):
         self.assertEquals(len(converter_path(self.stringTextValidator,
                                              Validator('string', 'json'))), 2)
 
+    def test_route_table(self):
+        target = Validator('string', 'json')
+        stats = get_route_table_stats()
+        path = converter_path(self.stringTextValidator, target)
+        self.assertEquals(get_route_table_stats()['hits'], stats['hits'] + 1)
+        self.assertEquals(get_route_table_stats()['misses'], stats['misses'])
+
+        # Modifying the graph invalidates the table, so the route is recomputed
+        conv_graph.add_node(Validator('string', 'newformat'))
+        self.assertEquals(get_route_table_stats()['size'], 0)
+        self.assertEquals(converter_path(self.stringTextValidator, target),
+                          path)
+        self.assertEquals(get_route_table_stats()['misses'],
+                          stats['misses'] + 1)
+        conv_graph.remove_node(Validator('string', 'newformat'))
+
+    @contextlib.contextmanager
+    def _plugin_converters(self, path):
+        """
+        Import the converters of a plugin, and remove them again on exit.
+        """
+        path = os.path.join(os.path.dirname(os.path.abspath(
+            girder_worker.__file__)), 'plugins', path)
+        validators = conv_graph.nodes()
+        edges = conv_graph.edges()
+        direct = dict(direct_converters)
+        try:
+            import_converters([path])
+            yield
+        finally:
+            conv_graph.remove_edges_from(
+                set(conv_graph.edges()) - set(edges))
+            conv_graph.remove_nodes_from(
+                set(conv_graph.nodes()) - set(validators))
+            direct_converters.clear()
+            direct_converters.update(direct)
+            build_route_table()
+
+    def _assert_only_direct(self, path, names):
+        """
+        Import the converters of a plugin, and check that the converters with
+        the given names are never a step of a longer conversion path, which
+        would change the paths taken between other formats.
+        """
+        with self._plugin_converters(path):
+            for source in conv_graph.nodes():
+                for target in conv_graph.nodes():
+                    try:
+                        route = converter_path(source, target)
+                    except NetworkXNoPath:
+                        continue
+                    if len(route) > 1:
+                        self.assertFalse(
+                            [c for c in route if c.get('name') in names],
+                            'Route %s -> %s' % (source, target))
+
+    def test_plugin_routes(self):
+        self._assert_only_direct(os.path.join('spark', 'converters'), [
+            'Spark DataFrame to JSON Lines'])
+
+        def names(source, target):
+            return [c.get('name') for c in converter_path(
+                Validator('table', source), Validator('table', target))]
+
+        with self._plugin_converters(os.path.join('r', 'converters', 'table')):
+            # Tables in other formats than CSV are exchanged with R without
+            # being formatted as CSV text
+            self.assertEqual(names('rows', 'r.dataframe'),
+                             ['Rows to Columns', 'Columns to R Dataframe'])
+            self.assertEqual(names('r.dataframe', 'rows'),
+                             ['R Dataframe to Columns', 'Columns to Rows'])
+
+            # CSV text is read and written by R itself
+            self.assertEqual(names('csv', 'r.dataframe'),
+                             ['CSV to R Dataframe'])
+            self.assertEqual(names('r.dataframe', 'csv'),
+                             ['R Dataframe to CSV'])
+
+    def test_converter_chain(self):
+        events = []
+
+        def handler(name):
+            return lambda e: events.append((name, e.info['task']))
+
+        for name in ('run.before', 'run.after'):
+            girder_worker.events.bind(name, 'test', handler(name))
+        try:
+            with mock.patch('girder_worker.run') as run:
+                output = girder_worker.convert(
+                    'table', {'format': 'csv', 'data': 'a,b\n1,2\n3,4\n'},
+                    {'format': 'objectlist.json'})
+        finally:
+            for name in ('run.before', 'run.after'):
+                girder_worker.events.unbind(name, 'test')
+
+        # The converters along the path are run without a full run() each,
+        # but still trigger the events of a run.
+        self.assertFalse(run.called)
+        path = converter_path(Validator('table', 'csv'),
+                              Validator('table', 'objectlist.json'))
+        self.assertEquals(len(path), 3)
+        self.assertEquals(events, [
+            (name, c) for c in path
+            for name in ('run.before', 'run.after')])
+        self.assertEquals(json.loads(output['data']),
+                          [{'a': 1, 'b': 2}, {'a': 3, 'b': 4}])
+
+    def test_converter_chain_namespace(self):
+        def converter(script):
+            return {
+                'name': script,
+                'inputs': [{'name': 'input', 'type': 'string',
+                            'format': 'text'}],
+                'outputs': [{'name': 'output', 'type': 'string',
+                             'format': 'text'}],
+                'script': script,
+                'mode': 'python'
+            }
+
+        # Each converter only sees the output of the previous one
+        path = [
+            converter('secret = 1\noutput = input + "b"'),
+            converter('output = input + str(sorted(\n'
+                      '    k for k in ("secret", "output") if k in globals()))')
+        ]
+        with mock.patch('girder_worker.converter_path', return_value=path):
+            output = girder_worker.convert(
+                'string', {'format': 'text', 'data': 'a'}, {'format': 'json'})
+        self.assertEquals(output['data'], 'ab[]')
+
+        # Outputs of each converter are validated
+        path[0]['script'] = 'output = 5'
+        with mock.patch('girder_worker.converter_path', return_value=path):
+            with self.assertRaisesRegexp(Exception, 'Output .*int'):
+                girder_worker.convert(
+                    'string', {'format': 'text', 'data': 'a'},
+                    {'format': 'json'})
+
+    def test_converter_files(self):
+        def converter(script, input='memory', output='memory'):
+            return {
+                'inputs': [{'name': 'input', 'type': 'string',
+                            'format': 'text', 'target': input}],
+                'outputs': [{'name': 'output', 'type': 'string',
+                             'format': 'text', 'target': output}],
+                'script': script,
+                'mode': 'python'
+            }
+
+        write = converter(
+            'import os, tempfile\n'
+            'output = tempfile.mktemp(dir=_tempdir)\n'
+            'with open(output, "w") as f:\n'
+            '    f.write(input + "b")', output='filepath')
+        read = converter(
+            'output = open(input).read() + "c"', input='filepath')
+
+        # Files written by converters are passed by path to converters that
+        # read files, and read into memory otherwise
+        with mock.patch('girder_worker.converter_path',
+                        return_value=[write, read, write]):
+            output = girder_worker.convert(
+                'string', {'format': 'text', 'data': 'a'}, {'format': 'json'})
+        self.assertEquals(output['data'], 'abcb')
+
+        # Inputs with a filepath target are converted from and to files
+        task = {
+            'inputs': [{'name': 'x', 'type': 'string', 'format': 'json',
+                        'target': 'filepath'}],
+            'outputs': [{'name': 'y', 'type': 'string', 'format': 'text'}],
+            'script': 'y = open(x).read()'
+        }
+        with mock.patch('girder_worker.converter_path',
+                        return_value=[read, write]):
+            outputs = girder_worker.run(
+                task, {'x': {'format': 'text', 'data': 'a'}})
+        self.assertEquals(outputs['y']['data'], 'acb')
+
+    def test_validator_function(self):
+        validator = Validator('table', 'rows')
+        self.assertTrue(get_validator_function(validator)({
+            'fields': [], 'rows': []}))
+        self.assertFalse(get_validator_function(validator)([]))
+
+        # Registered functions are called directly by isvalid
+        fn = get_validator_function(validator)
+        register_validator_function(
+            validator, lambda data, **kwargs: data == 'yes')
+        try:
+            with mock.patch('girder_worker.run') as run:
+                self.assertTrue(girder_worker.isvalid(
+                    'table', {'format': 'rows', 'data': 'yes'}))
+                self.assertFalse(girder_worker.isvalid(
+                    'table', {'format': 'rows', 'data': 'no'}))
+            self.assertFalse(run.called)
+        finally:
+            register_validator_function(validator, fn)
+
+        # Compiled validators run through the shared code cache, in the same
+        # environment as a full run of the validator.
+        validate = _compile_validator({
+            'script': 'output = (input, _tempdir, _job_manager)',
+            'mode': 'python'
+        })
+        hits = code_cache.stats()['hits']
+        self.assertEquals(validate('x', _tempdir='/tmp/a', _job_manager=1),
+                          ('x', '/tmp/a', 1))
+        self.assertEquals(code_cache.stats()['hits'], hits + 1)
+
     def test_run_exceptions(self):
         number_copy = {
             'inputs': [
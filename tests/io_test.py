@@ -1,11 +1,20 @@
+import BaseHTTPServer
 import copy
+import errno
 import httmock
+import mock
 import os
 import girder_worker
+import requests
 import shutil
+import ssl
+import threading
+import time
 import unittest
 
-from girder_worker.utils import JobStatus
+from girder_worker.io.http import HttpStreamPushAdapter
+from girder_worker.io.local import link_file
+from girder_worker.utils import http_session, JobStatus
 
 _tmp = None
 
@@ -106,6 +115,103 @@ with open(file) as f:
         self.assertEqual(outputs['out']['data'], 'a,b,c\n1,2,3\n')
         self.assertEqual(outputs['fname']['data'][-8:], 'file.csv')
 
+    def testLocalFilepath(self):
+        task = {
+            'mode': 'python',
+            'script': """
+fname = file
+with open(file) as f:
+    out = f.read()
+""",
+            'inputs': [{
+                'id': 'file',
+                'format': 'text',
+                'type': 'string',
+                'target': 'filepath'
+            }],
+            'outputs': [{
+                'id': 'out',
+                'format': 'text',
+                'type': 'string'
+            }, {
+                'id': 'fname',
+                'format': 'text',
+                'type': 'string'
+            }]
+        }
+
+        path = os.path.join(_tmp, 'local.csv')
+        if not os.path.isdir(_tmp):
+            os.makedirs(_tmp)
+        with open(path, 'w') as f:
+            f.write('a,b,c\n1,2,3\n')
+
+        inputs = {
+            'file': {
+                'mode': 'local',
+                'path': path,
+                'format': 'text',
+                'type': 'string'
+            }
+        }
+
+        outputs = girder_worker.run(task, inputs, cleanup=False)
+        self.assertEqual(outputs['out']['data'], 'a,b,c\n1,2,3\n')
+        linked = outputs['fname']['data']
+        self.assertNotEqual(linked, path)
+        self.assertEqual(os.path.basename(linked), 'local.csv')
+
+        # Removing the link must leave the original file in place
+        shutil.rmtree(os.path.dirname(linked))
+        self.assertTrue(os.path.isfile(path))
+
+        # Files are only hard linked if they have no write permission bits
+        # and are owned by another user, who alone could make them writable,
+        # and are otherwise copied
+        dst = os.path.join(_tmp, 'linked')
+        owner = os.stat(path).st_uid
+        mode = os.stat(path).st_mode
+        cases = ((0o444, owner + 1, True, 'hardlink'),
+                 (0o644, owner + 1, True, 'copy'),
+                 (0o444, owner, True, 'copy'),
+                 (0o444, owner + 1, False, 'copy'))
+        try:
+            for perms, euid, hardlink, method in cases:
+                os.chmod(path, perms)
+                with mock.patch('girder_worker.io.local._reflink',
+                                side_effect=OSError(errno.EXDEV, 'Cross')), \
+                        mock.patch('os.geteuid', return_value=euid):
+                    self.assertEqual(
+                        link_file(path, dst, hardlink=hardlink), method)
+                self.assertFalse(os.path.islink(dst))
+                self.assertEqual(
+                    os.path.samefile(path, dst), method == 'hardlink')
+                with open(dst) as f:
+                    self.assertEqual(f.read(), 'a,b,c\n1,2,3\n')
+        finally:
+            os.chmod(path, mode)
+
+        with open(dst, 'w') as f:
+            f.write('changed')
+        with open(path) as f:
+            self.assertEqual(f.read(), 'a,b,c\n1,2,3\n')
+
+        # Inputs with the same file name do not collide
+        other = os.path.join(_tmp, 'other')
+        if not os.path.isdir(other):
+            os.makedirs(other)
+        with open(os.path.join(other, 'local.csv'), 'w') as f:
+            f.write('x\n')
+        task['inputs'].append(dict(task['inputs'][0], id='file2'))
+        task['script'] += """
+with open(file2) as f:
+    out += f.read()
+"""
+        inputs['file2'] = dict(
+            inputs['file'], path=os.path.join(other, 'local.csv'))
+        outputs = girder_worker.run(task, inputs)
+        self.assertEqual(outputs['out']['data'], 'a,b,c\n1,2,3\nx\n')
+
     def testHttpIo(self):
         task = {
             'mode': 'python',
@@ -229,6 +335,151 @@ with open(file) as f:
         self.assertTrue('_tempdir' in outputs)
         self.assertRegexpMatches(outputs['_tempdir']['data'], _tmp + '.+')
 
+    def testLazyTempdir(self):
+        task = {
+            'inputs': [{'id': 'a', 'type': 'number', 'format': 'number'}],
+            'outputs': [{'id': 'b', 'type': 'boolean', 'format': 'boolean'}],
+            'script': 'b = a > 0'
+        }
+        inputs = {'a': {'format': 'json', 'data': '5'}}
+
+        # Tasks that declare that they do not use the temp dir, and the
+        # converters and validators of their inputs, do not create it
+        task['tempdir'] = False
+        with mock.patch('girder_worker.utils.ensure_tmpdir') as ensure:
+            outputs = girder_worker.run(task, copy.deepcopy(inputs))
+        self.assertFalse(ensure.called)
+        self.assertEqual(outputs['b']['data'], True)
+
+        # Other tasks get it however they refer to it
+        del task['tempdir']
+        task['script'] = 'import os\nb = os.path.isdir(globals()["_tempdir"])'
+        outputs = girder_worker.run(task, copy.deepcopy(inputs))
+        self.assertEqual(outputs['b']['data'], True)
+
+    def testConcurrentFetch(self):
+        threads = set()
+
+        def fetch(spec, **kwargs):
+            if spec['value'] < 0:
+                raise Exception('bad value')
+            time.sleep(0.05)
+            threads.add(threading.current_thread().ident)
+            return str(spec['value'])
+
+        girder_worker.io.register_fetch_handler('test', fetch)
+        task = {
+            'inputs': [{'id': name, 'type': 'number', 'format': 'json'}
+                       for name in 'abcd'],
+            'outputs': [{'id': 'e', 'type': 'number', 'format': 'number'}],
+            'script': 'e = sum(int(v) for v in (a, b, c, d))'
+        }
+        inputs = {name: {'mode': 'test', 'value': i, 'format': 'json'}
+                  for i, name in enumerate('abcd')}
+
+        outputs = girder_worker.run(task, copy.deepcopy(inputs))
+        self.assertEqual(outputs['e']['data'], 6)
+        self.assertGreater(len(threads), 1)
+
+        # Errors are reported along with the name of the failed input
+        inputs['c']['value'] = -1
+        with self.assertRaisesRegexp(Exception, '^c: bad value$'):
+            girder_worker.run(task, copy.deepcopy(inputs))
+
+        threads.clear()
+        girder_worker.config.set('girder_worker', 'fetch_concurrency', '1')
+        try:
+            inputs['c']['value'] = 2
+            outputs = girder_worker.run(task, copy.deepcopy(inputs))
+        finally:
+            girder_worker.config.set(
+                'girder_worker', 'fetch_concurrency', '4')
+        self.assertEqual(outputs['e']['data'], 6)
+        self.assertEqual(threads, {threading.current_thread().ident})
+
+    def testConcurrentLog(self):
+        def fetch(spec, **kwargs):
+            for i in range(200):
+                print 'input %s line %d' % (spec['value'], i)
+            return str(spec['value'])
+
+        girder_worker.io.register_fetch_handler('test', fetch)
+        task = {
+            'inputs': [{'id': name, 'type': 'number', 'format': 'json'}
+                       for name in 'abcd'],
+            'outputs': [{'id': 'e', 'type': 'number', 'format': 'number'}],
+            'script': 'e = sum(int(v) for v in (a, b, c, d))'
+        }
+        inputs = {name: {'mode': 'test', 'value': i, 'format': 'json'}
+                  for i, name in enumerate('abcd')}
+
+        # Lines printed by concurrent fetches are logged whole
+        job_mgr = girder_worker.utils.JobManager(False, url=None)
+        with mock.patch('sys.stdout', job_mgr):
+            girder_worker.run(task, inputs, _job_manager=job_mgr)
+        self.assertEqual(sorted(job_mgr._buf.splitlines()), sorted(
+            'input %d line %d' % (v, i) for v in range(4) for i in range(200)))
+
+    def testConcurrentPush(self):
+        threads = set()
+
+        def push(data, spec, **kwargs):
+            if data < 0:
+                raise Exception('bad value')
+            time.sleep(0.05)
+            threads.add(threading.current_thread().ident)
+            spec['pushed'] = data
+            return spec
+
+        girder_worker.io.register_push_handler('test', push)
+        task = {
+            'outputs': [{'id': name, 'type': 'number', 'format': 'number'}
+                        for name in 'abcd'],
+            'script': 'a, b, c, d = 0, 1, 2, 3'
+        }
+        outputs = {name: {'mode': 'test', 'format': 'number'}
+                   for name in 'abcd'}
+
+        results = girder_worker.run(task, outputs=copy.deepcopy(outputs))
+        self.assertEqual({name: result['pushed']
+                          for name, result in results.items()},
+                         {'a': 0, 'b': 1, 'c': 2, 'd': 3})
+        self.assertGreater(len(threads), 1)
+
+        # Errors are reported along with the name of the failed output
+        task['script'] = 'a, b, c, d = 0, 1, -1, 3'
+        with self.assertRaisesRegexp(Exception, '^c: bad value$'):
+            girder_worker.run(task, outputs=copy.deepcopy(outputs))
+
+    def testConcurrentPushLog(self):
+        def push(data, spec, **kwargs):
+            for i in range(200):
+                print 'output %d line %d' % (data, i)
+            return spec
+
+        girder_worker.io.register_push_handler('test', push)
+        task = {
+            'outputs': [{'id': name, 'type': 'number', 'format': 'number'}
+                        for name in 'abcd'],
+            'script': 'a, b, c, d = 0, 1, 2, 3'
+        }
+        outputs = {name: {'mode': 'test', 'format': 'number'}
+                   for name in 'abcd'}
+
+        # Lines printed by concurrent pushes are logged whole, and progress
+        # is reported once per pushed output
+        job_mgr = girder_worker.utils.JobManager(False, url=None)
+        with mock.patch('sys.stdout', job_mgr), mock.patch.object(
+                job_mgr, 'updateProgress') as progress:
+            girder_worker.run(task, outputs=outputs, _job_manager=job_mgr)
+        self.assertEqual(sorted(job_mgr._buf.splitlines()), sorted(
+            'output %d line %d' % (v, i) for v in range(4) for i in range(200)))
+        self.assertEqual([c[1]['current'] for c in progress.call_args_list],
+                         [1, 2, 3, 4])
+        self.assertEqual(sorted(c[1]['message']
+                                for c in progress.call_args_list),
+                         ['Pushed output %s' % name for name in 'abcd'])
+
     def testConvertingStatus(self):
         job_mgr = girder_worker.utils.JobManager(True, url='http://jobstatus/')
 
@@ -289,3 +540,76 @@ with open(file) as f:
             ]
             self.assertEqual(status_changes, [
                 'status=%d' % i for i in expected_statuses])
+
+    def testHttpSession(self):
+        session = http_session()
+        self.assertIs(http_session(), session)
+
+        adapter = session.get_adapter('https://example.com/')
+        self.assertEqual(adapter._pool_maxsize, girder_worker.config.getint(
+            'girder_worker', 'http_pool_maxsize'))
+        self.assertEqual(adapter.max_retries.total, girder_worker.config.getint(
+            'girder_worker', 'http_retries'))
+
+        # Forked processes get their own session
+        with mock.patch('os.getpid', return_value=os.getpid() + 1):
+            self.assertIsNot(http_session(), session)
+
+        # Streamed outputs are pushed through the shared session as well
+        received = []
+
+        def request(method, url, data, **kwargs):
+            received.extend(data)
+            status = 500 if 'fail' in received else 200
+            return mock.Mock(status_code=status, text='error')
+
+        with mock.patch.object(http_session(), 'request',
+                               side_effect=request) as req:
+            adapter = HttpStreamPushAdapter(
+                {'url': 'https://example.com/', 'method': 'PUT'})
+            for buf in ('a', '', 'b'):
+                adapter.write(buf)
+            adapter.close()
+            self.assertEqual(received, ['a', 'b'])
+            self.assertEqual(req.call_args[0], ('PUT', 'https://example.com/'))
+
+            adapter = HttpStreamPushAdapter({'url': 'https://example.com/'})
+            adapter.write('fail')
+            with self.assertRaisesRegexp(Exception, 'status 500'):
+                adapter.close()
+
+    def testUntrustedCertificate(self):
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            def do_GET(self):
+                self.send_response(200)
+                self.end_headers()
+                self.wfile.write('data')
+
+            do_POST = do_GET
+
+        server = BaseHTTPServer.HTTPServer(('localhost', 0), Handler)
+        server.socket = ssl.wrap_socket(
+            server.socket, server_side=True, certfile=os.path.join(
+                os.path.dirname(__file__), 'data', 'untrusted.pem'))
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        try:
+            url = 'https://localhost:%d/' % server.server_address[1]
+
+            # A self-signed certificate is rejected when streaming, fetching
+            # and pushing.
+            adapter = HttpStreamPushAdapter({'url': url})
+            with self.assertRaisesRegexp(
+                    requests.exceptions.ConnectionError, 'verify failed'):
+                adapter.write('data')
+                adapter.close()
+            with self.assertRaisesRegexp(
+                    requests.exceptions.SSLError, 'verify failed'):
+                girder_worker.io.fetch({'mode': 'http', 'url': url})
+            with self.assertRaisesRegexp(
+                    requests.exceptions.SSLError, 'verify failed'):
+                girder_worker.io.push('data', {'mode': 'http', 'url': url})
+        finally:
+            server.shutdown()
+            server.server_close()
@@ -0,0 +1,79 @@
+import girder_worker
+import girder_worker.__main__
+import mock
+import sys
+import unittest
+
+from girder_worker.executors.python import CodeCache
+from girder_worker.format import conv_graph
+
+
+class TestWorkerMain(unittest.TestCase):
+    def setUp(self):
+        self._preload = girder_worker.config.get(
+            'girder_worker', 'preload_modules')
+        self._max_tasks = girder_worker.config.get(
+            'girder_worker', 'max_tasks_per_child')
+
+    def tearDown(self):
+        girder_worker.config.set(
+            'girder_worker', 'preload_modules', self._preload)
+        girder_worker.config.set(
+            'girder_worker', 'max_tasks_per_child', self._max_tasks)
+
+    def test_preload_modules(self):
+        sys.modules.pop('colorsys', None)
+        girder_worker.config.set(
+            'girder_worker', 'preload_modules', 'colorsys, no_such_module,')
+
+        # Modules that cannot be imported are logged and skipped
+        with mock.patch.object(girder_worker.__main__, 'logger') as logger:
+            girder_worker.__main__._preload_modules()
+        self.assertIn('colorsys', sys.modules)
+        self.assertEqual(logger.warning.call_count, 1)
+        self.assertEqual(logger.warning.call_args[0][1], 'no_such_module')
+
+    def test_warm_code_cache(self):
+        cache = CodeCache(maxsize=1000)
+        with mock.patch.object(girder_worker.__main__, 'code_cache', cache):
+            girder_worker.__main__._warm_code_cache()
+
+        # Converters then find their compiled scripts in the cache
+        scripts = [analysis['script']
+                   for _, _, analysis in conv_graph.edges(data=True)
+                   if analysis.get('mode', 'python') == 'python' and
+                   'script' in analysis]
+        self.assertGreater(len(scripts), 0)
+        misses = cache.stats()['misses']
+        for script in scripts:
+            cache.compile(script)
+        self.assertEqual(cache.stats()['misses'], misses)
+
+    def test_main(self):
+        girder_worker.config.set(
+            'girder_worker', 'max_tasks_per_child', '100')
+
+        # Modules are preloaded and the code cache is warmed before the
+        # worker processes are forked
+        calls = mock.Mock()
+        with mock.patch.object(girder_worker.__main__, 'Celery',
+                               return_value=calls.app), \
+                mock.patch.object(girder_worker.__main__, '_preload_modules',
+                                  calls.preload), \
+                mock.patch.object(girder_worker.__main__, '_warm_code_cache',
+                                  calls.warm):
+            girder_worker.__main__.main()
+        calls.app.conf.update.assert_called_once_with(
+            CELERYD_MAX_TASKS_PER_CHILD=100)
+        names = [name for name, _, _ in calls.mock_calls]
+        self.assertLess(names.index('preload'), names.index('warm'))
+        self.assertLess(names.index('warm'), names.index('app.worker_main'))
+
+        # By default the worker processes are never replaced
+        girder_worker.config.set('girder_worker', 'max_tasks_per_child', '0')
+        with mock.patch.object(girder_worker.__main__, 'Celery') as celery, \
+                mock.patch.object(girder_worker.__main__, '_preload_modules'), \
+                mock.patch.object(girder_worker.__main__, '_warm_code_cache'):
+            girder_worker.__main__.main()
+        celery.return_value.conf.update.assert_called_once_with(
+            CELERYD_MAX_TASKS_PER_CHILD=None)
@@ -1,11 +1,15 @@
 import httmock
 import os
+import shutil
 import sys
+import tempfile
 import threading
+import time
 import unittest
 from . import captureOutput
 from girder_worker.io import make_stream_push_adapter, make_stream_fetch_adapter
-from girder_worker.utils import run_process
+from girder_worker.utils import (
+    run_process, StreamFetchAdapter, StreamPushAdapter)
 from six.moves import BaseHTTPServer, socketserver
 
 _iscript = os.path.join(os.path.dirname(__file__), 'stream_input.py')
@@ -120,3 +124,68 @@ class TestStream(unittest.TestCase):
             print(stdpipes)
             raise
         self.assertEqual(stdpipes, ['olleh\ndlrow\n', ''])
+
+    def testIdleProcess(self):
+        # Waiting for a subprocess that produces no output should not spin
+        cmd = [sys.executable, '-c', 'import time; time.sleep(1)']
+        start = sum(os.times()[:2])
+        with captureOutput() as stdpipes:
+            p = run_process(cmd)
+        self.assertEqual(p.returncode, 0)
+        self.assertEqual(stdpipes, ['', ''])
+        self.assertLess(sum(os.times()[:2]) - start, 0.5)
+
+    def testSlowInputStream(self):
+        # A slow input stream must not hold up reading the outputs
+        class SlowFetchAdapter(StreamFetchAdapter):
+            chunks = ['', 'input\n']
+
+            def read(self, buf_len):
+                time.sleep(0.5)
+                self.done = time.time()
+                return self.chunks.pop()
+
+        class RecordPushAdapter(StreamPushAdapter):
+            chunks = []
+
+            def write(self, buf):
+                self.chunks.append((time.time(), buf))
+
+        fetch = SlowFetchAdapter({})
+        push = RecordPushAdapter({})
+        script = ('import sys; print("ready"); sys.stdout.flush(); '
+                  'sys.stdout.write(sys.stdin.read())')
+        p = run_process([sys.executable, '-c', script],
+                        output_pipes={'_stdout': push},
+                        input_pipes={'_stdin': fetch})
+
+        self.assertEqual(p.returncode, 0)
+        self.assertEqual(''.join(buf for _, buf in push.chunks),
+                         'ready\ninput\n')
+        self.assertLess(push.chunks[0][0], fetch.done)
+
+    def testLocalStreams(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            inpath = os.path.join(tmp, 'in')
+            outpath = os.path.join(tmp, 'out')
+            data = os.urandom(1024 * 1024 + 7)
+            with open(inpath, 'wb') as f:
+                f.write(data)
+
+            # Once via the kernel, and once copying through python
+            for zero_copy in (True, False):
+                fetch = make_stream_fetch_adapter({
+                    'mode': 'local', 'path': inpath, 'buffer_size': 4096})
+                push = make_stream_push_adapter({
+                    'mode': 'local', 'path': outpath})
+                fetch._zero_copy = fetch._zero_copy and zero_copy
+                push._zero_copy = push._zero_copy and zero_copy
+
+                p = run_process(['cat'], output_pipes={'_stdout': push},
+                                input_pipes={'_stdin': fetch})
+                self.assertEqual(p.returncode, 0)
+                with open(outpath, 'rb') as f:
+                    self.assertEqual(f.read(), data)
+        finally:
+            shutil.rmtree(tmp)
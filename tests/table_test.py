@@ -369,6 +369,85 @@ class TestTable(unittest.TestCase):
         )
         self.assertEqual(len(output['data']['rows']), 3)
 
+    def test_numeric_conversion(self):
+        rows = [str(i) for i in range(1500)] + ['x', '', '2.5', 'inf']
+        output = girder_worker.format.csv_to_rows(
+            'a,b\n' + '\n'.join('%s,%s' % (v, v) for v in rows))
+
+        # Each value is converted separately, even in integer columns
+        self.assertEqual(len(output['rows']), 1504)
+        self.assertEqual(
+            [row['a'] for row in output['rows'][1498:]],
+            [1498, 1499, 'x', '', 2.5, 'inf'])
+
+        # File objects are read as a stream
+        with open(os.path.join('data', 'test.csv')) as f:
+            output = girder_worker.format.csv_to_rows(f)
+        self.assertEqual(len(output['fields']), 32)
+        self.assertEqual(len(output['rows']), 14)
+
+    def test_columns(self):
+        output = girder_worker.convert(
+            'table',
+            {'format': 'csv', 'data': 'a,b,c\n1,2.5,x\n3,4,\n'},
+            {'format': 'columns'})
+        self.assertEqual(output['format'], 'columns')
+        self.assertEqual(output['data']['fields'], ['a', 'b', 'c'])
+        columns = output['data']['columns']
+        self.assertEqual(columns['a'].dtype.name, 'int64')
+        self.assertEqual(columns['b'].dtype.name, 'float64')
+        self.assertEqual(columns['c'].dtype.name, 'object')
+        self.assertEqual(columns['c'].tolist(), ['x', ''])
+
+        output = girder_worker.convert(
+            'table', output, {'format': 'rows'})
+        self.assertEqual(output['data'], {
+            'fields': ['a', 'b', 'c'],
+            'rows': [{'a': 1, 'b': 2.5, 'c': 'x'}, {'a': 3, 'b': 4.0, 'c': ''}]
+        })
+
+        output = girder_worker.convert(
+            'table', output, {'format': 'columns'})
+        output = girder_worker.convert(
+            'table', output, {'format': 'csv'})
+        self.assertEqual(output['data'].splitlines(),
+                         ['a,b,c', '1,2.5,x', '3,4.0,'])
+
+    def test_arrow(self):
+        output = girder_worker.convert(
+            'table',
+            {'format': 'csv', 'data': 'a,b,c\n1,2.5,x\n3,,y\n'},
+            {'format': 'arrow'})
+        table = output['data']
+        self.assertEqual(table.schema.names, ['a', 'b', 'c'])
+        self.assertEqual(str(table.schema.types[1]), 'double')
+
+        for format in ('arrow.file', 'parquet'):
+            output = girder_worker.convert(
+                'table', {'format': 'arrow', 'data': table},
+                {'format': format})
+            output = girder_worker.convert(
+                'table', output, {'format': 'rows'})
+            self.assertEqual(output['data'], {
+                'fields': ['a', 'b', 'c'],
+                'rows': [{'a': 1, 'b': 2.5, 'c': 'x'},
+                         {'a': 3, 'b': None, 'c': 'y'}]
+            })
+
+        # Files fetched to a path are read from the path
+        output = girder_worker.convert(
+            'table', {'format': 'arrow', 'data': table},
+            {'format': 'arrow.file'})
+        outputs = girder_worker.run({
+            'inputs': [{'name': 'a', 'type': 'table', 'format': 'arrow',
+                        'target': 'filepath'}],
+            'outputs': [{'name': 'b', 'type': 'table', 'format': 'arrow'}],
+            'script': 'b = a',
+            'mode': 'python'
+        }, {'a': output}, {'b': {'format': 'csv'}})
+        self.assertEqual(outputs['b']['data'].splitlines(),
+                         ['a,b,c', '1,2.5,x', '3,,y'])
+
     def test_sniffer(self):
         output = girder_worker.convert(
             'table',
@@ -1,5 +1,12 @@
+import copy
 import girder_worker
+import girder_worker.executors.step_cache
+import httmock
+import mock
 import os
+import shutil
+import tempfile
+import threading
 import unittest
 
 
@@ -387,6 +394,254 @@ class TestWorkflow(unittest.TestCase):
             }
         }])
 
+    def test_concurrent_steps(self):
+        def step(name, script):
+            return {
+                'name': name,
+                'task': {
+                    'inputs': [{'name': 'e', 'type': 'python',
+                                'format': 'object'}],
+                    'outputs': [{'name': 'r', 'type': 'boolean',
+                                 'format': 'boolean'}],
+                    'script': script
+                }
+            }
+
+        # Step "a" only succeeds if step "b" runs while it is waiting
+        workflow = {
+            'mode': 'workflow',
+            'inputs': [{'name': 'e', 'type': 'python', 'format': 'object'}],
+            'outputs': [{'name': 'ra', 'type': 'boolean', 'format': 'boolean'},
+                        {'name': 'rb', 'type': 'boolean', 'format': 'boolean'}],
+            'steps': [step('a', 'e.wait(10)\nr = e.is_set()'),
+                      step('b', 'e.set()\nr = True')],
+            'connections': [
+                {'name': 'e', 'input_step': 'a', 'input': 'e'},
+                {'name': 'e', 'input_step': 'b', 'input': 'e'},
+                {'name': 'ra', 'output_step': 'a', 'output': 'r'},
+                {'name': 'rb', 'output_step': 'b', 'output': 'r'}
+            ]
+        }
+
+        girder_worker.config.set('girder_worker', 'workflow_concurrency', '2')
+        try:
+            outputs = girder_worker.run(workflow, inputs={
+                'e': {'format': 'object', 'data': threading.Event()}})
+            self.assertTrue(outputs['ra']['data'])
+            self.assertTrue(outputs['rb']['data'])
+
+            # The error of a failed step is raised
+            workflow['steps'][1]['task']['script'] = 'e.set()\nr = 1 / 0'
+            with self.assertRaisesRegexp(Exception, 'by zero'):
+                girder_worker.run(workflow, inputs={
+                    'e': {'format': 'object', 'data': threading.Event()}})
+
+            # So are errors that are not exceptions
+            workflow['steps'][1]['task']['script'] = 'e.set()\nraise SystemExit'
+            with self.assertRaises(SystemExit):
+                girder_worker.run(workflow, inputs={
+                    'e': {'format': 'object', 'data': threading.Event()}})
+
+            # Lines printed by concurrent steps are logged whole
+            script = 'for i in range(200):\n    print "%s", i\nr = True'
+            workflow['steps'] = [
+                step('a', 'e.wait(10)\n' + script % 'a'),
+                step('b', 'e.set()\n' + script % 'b')]
+            job_mgr = girder_worker.utils.JobManager(False, url=None)
+            with mock.patch('sys.stdout', job_mgr):
+                girder_worker.run(workflow, inputs={
+                    'e': {'format': 'object', 'data': threading.Event()}},
+                    _job_manager=job_mgr)
+            lines = [line for line in job_mgr._buf.splitlines()
+                     if not line.startswith('---')]
+            self.assertEqual(sorted(lines), sorted(
+                '%s %d' % (s, i) for s in 'ab' for i in range(200)))
+        finally:
+            girder_worker.config.set(
+                'girder_worker', 'workflow_concurrency', '1')
+
+    def test_stream_connection(self):
+        producer = {
+            'outputs': [{'name': 'out', 'type': 'string', 'format': 'text',
+                         'stream': True}],
+            'script': 'for i in range(1024):\n    out.write("x" * 1024)'
+        }
+        consumer = {
+            'inputs': [{'name': 'inp', 'type': 'string', 'format': 'text',
+                        'stream': True}],
+            'outputs': [{'name': 'n', 'type': 'number', 'format': 'number'}],
+            'script': """
+n = 0
+while True:
+    buf = inp.read(65536)
+    if not buf:
+        break
+    n += len(buf)
+"""
+        }
+        workflow = {
+            'mode': 'workflow',
+            'outputs': [{'name': 'n', 'type': 'number', 'format': 'number'}],
+            'steps': [{'name': 'p', 'task': producer},
+                      {'name': 'c', 'task': consumer}],
+            'connections': [
+                {'output_step': 'p', 'output': 'out', 'input_step': 'c',
+                 'input': 'inp', 'stream': True},
+                {'name': 'n', 'output_step': 'c', 'output': 'n'}
+            ]
+        }
+
+        # The output is larger than a pipe buffer, so the steps must run
+        # concurrently.
+        outputs = girder_worker.run(workflow)
+        self.assertEqual(outputs['n']['data'], 1024 * 1024)
+
+        # Non-streaming inputs read the whole stream
+        del consumer['inputs'][0]['stream']
+        consumer['script'] = 'n = len(inp)'
+        outputs = girder_worker.run(workflow)
+        self.assertEqual(outputs['n']['data'], 1024 * 1024)
+
+        # A failed consumer does not leave the producer blocked
+        consumer['script'] = 'raise Exception("consumer failed")'
+        with self.assertRaisesRegexp(Exception, 'consumer failed'):
+            girder_worker.run(workflow)
+
+    def test_stream_subprocesses(self):
+        # Steps that stream through subprocesses, e.g. docker tasks, must not
+        # leak the ends of the pipes to each other's subprocesses, or the
+        # reading subprocess never sees the end of the stream.
+        producer = {
+            'outputs': [{'name': 'out', 'type': 'string', 'format': 'text',
+                         'stream': True}],
+            'script': """
+from girder_worker.utils import run_process
+run_process(['sh', '-c', 'echo hi'], output_pipes={'_stdout': out})
+"""
+        }
+        consumer = {
+            'inputs': [{'name': 'inp', 'type': 'string', 'format': 'text',
+                        'stream': True}],
+            'outputs': [{'name': 'r', 'type': 'string', 'format': 'text'}],
+            'script': """
+from girder_worker.utils import AccumulateDictAdapter, run_process
+result = {}
+run_process(['cat'], input_pipes={'_stdin': inp}, output_pipes={
+    '_stdout': AccumulateDictAdapter(result, 'r')})
+r = result['r']
+"""
+        }
+        workflow = {
+            'mode': 'workflow',
+            'outputs': [{'name': 'r', 'type': 'string', 'format': 'text'}],
+            'steps': [{'name': 'p', 'task': producer},
+                      {'name': 'c', 'task': consumer}],
+            'connections': [
+                {'output_step': 'p', 'output': 'out', 'input_step': 'c',
+                 'input': 'inp', 'stream': True},
+                {'name': 'r', 'output_step': 'c', 'output': 'r'}
+            ]
+        }
+
+        outputs = girder_worker.run(workflow)
+        self.assertEqual(outputs['r']['data'], 'hi\n')
+
+    def test_step_tempdirs(self):
+        def writer(data):
+            return {
+                'outputs': [{'name': 'f', 'type': 'string', 'format': 'text',
+                             'target': 'filepath'}],
+                'script': """
+import os
+f = os.path.join(_tempdir, 'out.txt')
+with open(f, 'w') as fh:
+    fh.write('%s')
+""" % data
+            }
+
+        reader = {
+            'inputs': [{'name': 'f', 'type': 'string', 'format': 'text'}],
+            'outputs': [{'name': 'r', 'type': 'string', 'format': 'text'}],
+            'script': 'with open(f) as fh:\n    r = fh.read()'
+        }
+        workflow = {
+            'mode': 'workflow',
+            'outputs': [{'name': 'r', 'type': 'string', 'format': 'text'}],
+            'steps': [{'name': 'a', 'task': writer('A')},
+                      {'name': 'b', 'task': writer('B')},
+                      {'name': 'c', 'task': reader}],
+            'connections': [
+                {'output_step': 'a', 'output': 'f', 'input_step': 'c',
+                 'input': 'f'},
+                {'name': 'r', 'output_step': 'c', 'output': 'r'}
+            ]
+        }
+
+        # Steps writing files of the same name do not overwrite each other
+        outputs = girder_worker.run(workflow)
+        self.assertEqual(outputs['r']['data'], 'A')
+
+    def test_step_cache(self):
+        tmp = tempfile.mkdtemp()
+        cache_dir = os.path.join(tmp, 'cache')
+        girder_worker.config.set('girder_worker', 'step_cache_dir', cache_dir)
+        try:
+            def run(x, y):
+                outputs = girder_worker.run(self.workflow, inputs={
+                    'x': copy.deepcopy(x) if isinstance(x, dict) else {
+                        'format': 'number', 'data': x},
+                    'y': {'format': 'number', 'data': y}
+                })
+                return outputs['result']['data']
+
+            cache = girder_worker.executors.step_cache.get_step_cache()
+            self.assertEqual(run(1, 2), (1+3)*(2+2))
+            self.assertEqual(cache.stats()['misses'], 3)
+
+            # Unchanged steps are skipped
+            self.assertEqual(run(1, 2), (1+3)*(2+2))
+            self.assertEqual(cache.stats()['hits'], 3)
+            self.assertEqual(run(1, 3), (1+3)*(3+2))
+            self.assertEqual(cache.stats()['hits'], 4)
+            self.assertEqual(cache.stats()['misses'], 5)
+
+            # The least recently used outputs are evicted
+            cache.maxsize = cache.stats()['size'] - 1
+            cache.put('key', {})
+            self.assertGreater(cache.stats()['evictions'], 0)
+            self.assertLessEqual(cache.stats()['size'], cache.maxsize)
+
+            # Only the owner may write entries, as they are unpickled
+            self.assertEqual(os.stat(cache_dir).st_mode & 0o777, 0o700)
+
+            # Inputs fetched over HTTP are identified by their ETag, which is
+            # not added to the input binding
+            body = ['1']
+
+            @httmock.all_requests
+            def fetch_mock(url, request):
+                return httmock.response(200, body[0], {'ETag': '"v1"'})
+
+            cache.maxsize = 1 << 20
+            cache.clear()
+            x = {'mode': 'http', 'url': 'http://foo.com/x', 'format': 'json'}
+            with httmock.HTTMock(fetch_mock):
+                self.assertEqual(run(x, 2), (1+3)*(2+2))
+
+                # The response is not looked at if its ETag is unchanged
+                body[0] = '5'
+                self.assertEqual(run(x, 2), (1+3)*(2+2))
+
+            # The ETag is not added to the input binding
+            x = {'mode': 'http', 'url': 'http://foo.com/x', 'format': 'json'}
+            with httmock.HTTMock(fetch_mock):
+                girder_worker.run(self.workflow, inputs={
+                    'x': x, 'y': {'format': 'number', 'data': 2}})
+            self.assertNotIn('etag', x)
+        finally:
+            girder_worker.config.set('girder_worker', 'step_cache_dir', '')
+            shutil.rmtree(tmp)
+
     def test_load(self):
         flu = girder_worker.load(os.path.join(
             self.analysis_path, 'xdata', 'flu.json'))